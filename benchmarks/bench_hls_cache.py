@@ -0,0 +1,109 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hls_cache import SegmentCache, HLSFetcher, LocalHLSServer
+
+
+def make_stub_server(n_segments, segment_bytes, latency):
+    """
+    Start a local HLS stub server with a master playlist, one media playlist and
+    `n_segments` random segments, each response delayed by `latency` seconds.
+
+    :return: (server, files dict mapping path to bytes, request counter dict)
+    """
+    files = {
+        "/master.m3u8": b"#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=800000\nvideo/index.m3u8\n",
+    }
+    media = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:2"]
+    for i in range(n_segments):
+        media += ["#EXTINF:2.0,", f"seg{i:03d}.ts"]
+        files[f"/video/seg{i:03d}.ts"] = os.urandom(segment_bytes)
+    media.append("#EXT-X-ENDLIST")
+    files["/video/index.m3u8"] = ("\n".join(media) + "\n").encode()
+    requests = {"count": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            requests["count"] += 1
+            body = files.get(self.path)
+            if body is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, files, requests
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="HLS segment cache against a local stub server")
+    parser.add_argument('--segments', type=int, default=60, help='Number of segments (default: 60)')
+    parser.add_argument('--segment-kb', type=int, default=256, help='Segment size in KB (default: 256)')
+    parser.add_argument('--latency', type=float, default=0.05, help='Stub latency per request (default: 0.05s)')
+    args = parser.parse_args()
+
+    stub, files, requests = make_stub_server(args.segments, args.segment_kb * 1024, args.latency)
+    playlist_url = f"http://127.0.0.1:{stub.server_address[1]}/master.m3u8"
+
+    # Untimed run so one-off costs (imports, SSL context) do not skew the first timing
+    with tempfile.TemporaryDirectory() as warmup_dir:
+        await HLSFetcher(SegmentCache(warmup_dir)).fetch(playlist_url)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = SegmentCache(cache_dir)
+        timings = {}
+        for label, connections in (("sequential", 1), ("pooled x8", 8)):
+            # Forget the stream so each run downloads it again
+            cache.index["urls"].clear()
+            cache.index["playlists"].clear()
+            start = time.perf_counter()
+            local_playlist = await HLSFetcher(cache, max_connections=connections).fetch(playlist_url)
+            timings[label] = time.perf_counter() - start
+
+        before = requests["count"]
+        start = time.perf_counter()
+        await HLSFetcher(cache).fetch(playlist_url)
+        timings["warm cache"] = time.perf_counter() - start
+        # A finished stream is served from the cache without refreshing its playlists
+        warm_requests = requests["count"] - before
+
+        # Replay through the local static endpoint and check every byte
+        import httpx
+        server = LocalHLSServer(cache, port=0).start()
+        with httpx.Client() as client:
+            master = client.get(server.url_for(local_playlist)).text
+            variant_url = server.url_for("playlists/" + master.strip().splitlines()[-1])
+            variant = client.get(variant_url).text
+            segments = [line for line in variant.splitlines() if line and not line.startswith("#")]
+            served = [client.get(variant_url.rsplit("/", 1)[0] + "/" + uri).content for uri in segments]
+        server.stop()
+
+    stub.shutdown()
+    expected = [files[f"/video/seg{i:03d}.ts"] for i in range(args.segments)]
+    assert served == expected, "locally served segments differ from the origin"
+    assert warm_requests == 0, f"warm fetch made {warm_requests} requests"
+
+    print(f"{args.segments} segments x {args.segment_kb} KB, {args.latency * 1000:.0f} ms latency")
+    for label, seconds in timings.items():
+        print(f"{label:<12}{seconds:>8.2f}s")
+    print("local replay: all segments identical to origin")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,103 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from refinement_engine import (
+    INSTRUCTIONS,
+    LENGTH_SUFFIX,
+    LlamaCppPoolBackend,
+    LlamaServerBackend,
+    RefinementEngine,
+    extract_transcript_from_json,
+)
+from resilience import ServiceError
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRANSCRIPTS = ["sample.json", "b.json"]
+
+
+def load_jobs(repeat):
+    """
+    :param repeat: Number of copies of the (transcript, instruction) grid
+    :return: List of (transcript, instruction) refinement jobs
+    """
+    transcripts = []
+    for name in TRANSCRIPTS:
+        with open(os.path.join(REPO_DIR, name), 'r') as file:
+            transcripts.append(extract_transcript_from_json(json.load(file)))
+    jobs = [(transcript, instruction + LENGTH_SUFFIX)
+            for transcript in transcripts for instruction in INSTRUCTIONS]
+    return jobs * repeat
+
+
+async def run_backend(backend, jobs, max_tokens, concurrency):
+    """
+    Start a backend, run the jobs concurrently and stop it.
+
+    :return: Dict with the startup, batch wall time and per-request latencies
+    """
+    # Caching disabled so repeated jobs are really generated
+    engine = RefinementEngine(backend, cache_size=0, max_concurrency=concurrency, timeout=300.0)
+
+    start = time.perf_counter()
+    await engine.start()
+    startup = time.perf_counter() - start
+
+    latencies = []
+
+    async def timed(transcript, instruction):
+        request_start = time.perf_counter()
+        try:
+            await engine.refine(transcript, instruction, max_tokens=max_tokens, temperature=0.0)
+        except ServiceError:
+            # Counted in engine.metrics["errors"]
+            return
+        latencies.append(time.perf_counter() - request_start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(transcript, instruction) for transcript, instruction in jobs))
+    wall = time.perf_counter() - start
+
+    await engine.stop()
+    return {"startup": startup, "wall": wall, "latencies": latencies, "errors": engine.metrics["errors"]}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="In-process llama-cpp-python pool vs llama-server subprocess + HTTP")
+    parser.add_argument('model_path', help='Path to the GGUF model')
+    parser.add_argument('--workers', type=int, default=2, help='Pool workers / server slots (default: 2)')
+    parser.add_argument('--port', type=int, default=8080, help='llama-server port (default: 8080)')
+    parser.add_argument('--repeat', type=int, default=1, help='Copies of the job grid (default: 1)')
+    parser.add_argument('--max-tokens', type=int, default=150, help='Tokens per refinement (default: 150)')
+    args = parser.parse_args()
+
+    jobs = load_jobs(args.repeat)
+    threads = max(1, (os.cpu_count() or 1) // args.workers)
+    backends = [
+        ("llama-server + HTTP", LlamaServerBackend(
+            args.model_path, port=args.port, threads=threads * args.workers,
+            extra_server_args=['--parallel', str(args.workers)])),
+        ("llama-cpp-python pool", LlamaCppPoolBackend(
+            args.model_path, workers=args.workers, threads_per_worker=threads)),
+    ]
+
+    results = {}
+    for label, backend in backends:
+        results[label] = await run_backend(backend, jobs, args.max_tokens, args.workers)
+
+    print(f"\n{len(jobs)} refinements, {args.workers} workers")
+    print(f"{'backend':<24}{'startup s':>10}{'batch s':>10}{'p50 s':>8}{'max s':>8}{'errors':>8}")
+    for label, r in results.items():
+        latencies = r["latencies"] or [float('nan')]
+        print(f"{label:<24}{r['startup']:>10.2f}{r['wall']:>10.2f}"
+              f"{statistics.median(latencies):>8.2f}{max(latencies):>8.2f}{r['errors']:>8}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+import os
+import sys
+import json
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from refinePitchText2 import LlamaCppServerModifier
+from refinement_engine import extract_transcript_from_json
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRANSCRIPTS = ["sample.json", "b.json"]
+INSTRUCTION = "Make this pitch more engaging, concise, and impactful. keep the speech length same."
+
+
+def load_transcripts():
+    """
+    Load the bundled Deepgram transcripts used as benchmark inputs.
+
+    :return: List of (name, transcript) tuples
+    """
+    transcripts = []
+    for name in TRANSCRIPTS:
+        with open(os.path.join(REPO_DIR, name), 'r') as file:
+            transcripts.append((name, extract_transcript_from_json(json.load(file))))
+    return transcripts
+
+
+async def run_config(label, modifier_kwargs, transcripts, runs, max_tokens):
+    """
+    Run every transcript through one server configuration and collect timings.
+
+    :param label: Name of the configuration in the report
+    :param modifier_kwargs: Keyword arguments for LlamaCppServerModifier
+    :param transcripts: List of (name, transcript) tuples
+    :param runs: Number of repetitions per transcript
+    :param max_tokens: Number of tokens to generate per request
+    :return: Dict mapping transcript name to list of tokens/sec samples
+    """
+    results = {}
+    # Caching disabled so every repetition is really generated
+    async with LlamaCppServerModifier(**modifier_kwargs, cache_size=0) as modifier:
+        for name, transcript in transcripts:
+            samples = []
+            for _ in range(runs):
+                # Greedy sampling so both configurations generate the same text
+                refined = await modifier.modify_text(transcript, instruction=INSTRUCTION,
+                                                     max_tokens=max_tokens, temperature=0.0)
+                timings = modifier.last_timings or {}
+                # After a failed request last_timings still holds the previous request's
+                if refined is not None and 'predicted_per_second' in timings:
+                    samples.append(timings['predicted_per_second'])
+            results[name] = samples
+            print(f"[{label}] {name}: {len(samples)} samples")
+    return results
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Speculative decoding benchmark for llama-server")
+    parser.add_argument('model_path', help='Path to the main GGUF model')
+    parser.add_argument('draft_model_path', help='Path to the draft GGUF model')
+    parser.add_argument('--port', type=int, default=8080, help='Port for the server (default: 8080)')
+    parser.add_argument('--runs', type=int, default=3, help='Repetitions per transcript (default: 3)')
+    parser.add_argument('--max-tokens', type=int, default=150, help='Tokens generated per request (default: 150)')
+    parser.add_argument('--draft-max', type=int, default=16, help='Max draft tokens per step (default: 16)')
+    args = parser.parse_args()
+
+    transcripts = load_transcripts()
+    configs = [
+        ("off", {'model_path': args.model_path, 'port': args.port}),
+        ("on", {'model_path': args.model_path, 'port': args.port,
+                'draft_model_path': args.draft_model_path, 'draft_max': args.draft_max}),
+    ]
+
+    report = {}
+    for label, kwargs in configs:
+        report[label] = await run_config(label, kwargs, transcripts, args.runs, args.max_tokens)
+
+    print("\n--- Tokens/sec (median) ---")
+    print(f"{'transcript':<15}{'off':>10}{'on':>10}{'speedup':>10}")
+    for name, _ in transcripts:
+        off = statistics.median(report["off"][name]) if report["off"][name] else float('nan')
+        on = statistics.median(report["on"][name]) if report["on"][name] else float('nan')
+        print(f"{name:<15}{off:>10.1f}{on:>10.1f}{on / off:>9.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+import os
+import re
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_time(module, runs):
+    """
+    Measure the import cost of a module in fresh interpreters with `-X importtime`.
+
+    :param module: Module to import
+    :param runs: Number of fresh interpreters
+    :return: (median cumulative microseconds, list of the slowest (microseconds, module) imports)
+    """
+    totals, slowest = [], {}
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                cwd=REPO_DIR, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"import {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+        for line in result.stderr.splitlines():
+            match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)", line)
+            if not match:
+                continue
+            cumulative, depth, name = int(match.group(2)), len(match.group(3)), match.group(4)
+            if name == module and depth == 1:
+                totals.append(cumulative)
+            # Top-level packages only, nested imports are included in their cumulative time
+            if depth <= 3:
+                slowest[name] = max(slowest.get(name, 0), cumulative)
+    top = sorted(((us, name) for name, us in slowest.items() if name != module), reverse=True)[:10]
+    return statistics.median(totals), top
+
+
+def rerun_latency(page, runs):
+    """
+    Measure Streamlit rerun latency of a page with the AppTest harness.
+
+    :param page: Streamlit script path
+    :param runs: Number of reruns
+    :return: (first run seconds, median rerun seconds), or None if Streamlit is missing
+    """
+    try:
+        from streamlit.testing.v1 import AppTest
+    except ImportError:
+        return None
+
+    app = AppTest.from_file(os.path.join(REPO_DIR, page), default_timeout=60)
+    start = time.perf_counter()
+    app.run()
+    first = time.perf_counter() - start
+
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        app.run()
+        samples.append(time.perf_counter() - start)
+    return first, statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup benchmark of the CLI and Streamlit entry points")
+    parser.add_argument('--modules', nargs='+', default=['pitch', 'trancription', 'simli'],
+                        help='Modules to import (default: pitch trancription simli)')
+    parser.add_argument('--pages', nargs='+', default=['hello_simly.py', 'hello_simli.py'],
+                        help='Streamlit pages to rerun (default: hello_simly.py hello_simli.py)')
+    parser.add_argument('--runs', type=int, default=5, help='Repetitions (default: 5)')
+    args = parser.parse_args()
+
+    print("--- python -X importtime (median of fresh interpreters) ---")
+    for module in args.modules:
+        try:
+            total, top = import_time(module, args.runs)
+        except RuntimeError as e:
+            print(f"{module}: {e}")
+            continue
+        print(f"\n{module}: {total / 1000:.1f} ms")
+        for us, name in top:
+            print(f"    {us / 1000:>8.1f} ms  {name}")
+
+    print("\n--- Streamlit rerun latency ---")
+    for page in args.pages:
+        latency = rerun_latency(page, args.runs)
+        if latency is None:
+            print("streamlit is not installed, skipping rerun latency")
+            break
+        first, rerun = latency
+        print(f"{page}: first run {first * 1000:.1f} ms, rerun {rerun * 1000:.1f} ms (median)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import os
+import sys
+import json
+import time
+import wave
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trancription import TranscriptionBackend, FasterWhisperBackend
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class DeepgramStubBackend(TranscriptionBackend):
+    """
+    Offline stand-in for Deepgram that models the cost of a remote job: a round
+    trip, the upload of the whole file and server-side processing proportional to
+    the audio duration. It returns the bundled sample.json response.
+    """
+    name = "deepgram-stub"
+
+    def __init__(self, rtt=0.15, upload_mbps=20.0, realtime_factor=0.05):
+        """
+        :param rtt: Network round trip time in seconds
+        :param upload_mbps: Upload bandwidth in megabits per second
+        :param realtime_factor: Server processing time per second of audio
+        """
+        self.rtt = rtt
+        self.upload_mbps = upload_mbps
+        self.realtime_factor = realtime_factor
+        with open(os.path.join(REPO_DIR, "sample.json"), 'r') as file:
+            self.response = json.load(file)
+
+    def transcribe_file(self, audio_path):
+        upload_seconds = os.path.getsize(audio_path) * 8 / (self.upload_mbps * 1e6)
+        time.sleep(self.rtt + upload_seconds + audio_duration(audio_path) * self.realtime_factor)
+        return self.response
+
+
+def audio_duration(audio_path):
+    """
+    :param audio_path: Path to a WAV file
+    :return: Duration in seconds
+    """
+    with wave.open(audio_path, 'rb') as wav:
+        return wav.getnframes() / wav.getframerate()
+
+
+def run_backend(backend, audio_paths):
+    """
+    Transcribe the files through one backend and time it.
+
+    :param backend: TranscriptionBackend instance
+    :param audio_paths: Paths to the WAV files
+    :return: (wall seconds, number of words) tuple
+    """
+    start = time.perf_counter()
+    responses = backend.transcribe_many(audio_paths)
+    elapsed = time.perf_counter() - start
+    words = sum(len(r['results']['channels'][0]['alternatives'][0]['words']) for r in responses)
+    return elapsed, words
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare local transcription with the Deepgram stub")
+    parser.add_argument('audio_paths', nargs='+', help='WAV files to transcribe')
+    parser.add_argument('--model-size', default='small.en', help='faster-whisper model (default: small.en)')
+    parser.add_argument('--batch-size', type=int, default=0, help='faster-whisper batch size (default: off)')
+    parser.add_argument('--upload-mbps', type=float, default=20.0, help='Stub upload bandwidth (default: 20)')
+    args = parser.parse_args()
+
+    total_audio = sum(audio_duration(path) for path in args.audio_paths)
+
+    local = FasterWhisperBackend(model_size=args.model_size, batch_size=args.batch_size)
+    load_start = time.perf_counter()
+    local._load_model()
+    load_seconds = time.perf_counter() - load_start
+
+    results = [
+        ("deepgram-stub", run_backend(DeepgramStubBackend(upload_mbps=args.upload_mbps), args.audio_paths)),
+        ("faster-whisper", run_backend(local, args.audio_paths)),
+    ]
+
+    print(f"\n{len(args.audio_paths)} files, {total_audio:.1f}s of audio "
+          f"(faster-whisper model load {load_seconds:.2f}s, paid once)")
+    print(f"{'backend':<16}{'seconds':>10}{'RTF':>8}{'words':>8}")
+    for name, (elapsed, words) in results:
+        print(f"{name:<16}{elapsed:>10.2f}{elapsed / total_audio:>8.3f}{words:>8}")
+
+
+if __name__ == "__main__":
+    main()
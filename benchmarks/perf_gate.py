@@ -0,0 +1,378 @@
+import io
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import contextlib
+import threading
+import statistics
+import subprocess
+import tracemalloc
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HISTORY_PATH = os.path.join(REPO_DIR, "benchmarks", "perf_history.json")
+
+
+def make_stub_server(latency):
+    """
+    Start a local stub of llama-server (/health, /completion) and of the Simli
+    render endpoint, each response delayed by `latency` seconds.
+
+    :return: ThreadingHTTPServer
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, data):
+            body = json.dumps(data).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path != "/health":
+                self.send_error(404)
+                return
+            self._reply({"status": "ok"})
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            time.sleep(latency)
+            if self.path == "/completion":
+                # Echo the transcript back, as a length-preserving refinement would
+                original = request.get("prompt", "").rsplit("Original Text:", 1)[-1]
+                self._reply({"content": " " + original.split("\n\nModified Text:")[0].strip(),
+                             "timings": {"predicted_per_second": 0.0}})
+            elif self.path == "/textToVideoStream":
+                self._reply({"hls_url": f"http://127.0.0.1:{self.server.server_port}/render/index.m3u8"})
+            else:
+                self.send_error(404)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_test_video(path, seconds=10):
+    """
+    Render a small synthetic video with a tone track for the audio extraction stages.
+    """
+    subprocess.run(["ffmpeg", "-y", "-loglevel", "error",
+                    "-f", "lavfi", "-i", f"testsrc=size=320x240:rate=25:duration={seconds}",
+                    "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+                    "-c:v", "libx264", "-preset", "ultrafast", "-c:a", "aac", "-shortest", path],
+                   check=True)
+
+
+async def build_stages(tmp_dir, server):
+    """
+    :return: (dict of stage name to callable, cleanup coroutine function). Stages may be
+        sync or async; stages needing ffmpeg are left out when it is not installed.
+    """
+    from refinement_engine import LlamaServerBackend, RefinementEngine, extract_transcript_from_json
+    from transcript_cleaning import clean_transcript
+    from trancription import BACKENDS
+    from bench_transcription import DeepgramStubBackend
+    from pitch import Pitch
+
+    with open(os.path.join(REPO_DIR, "sample.json"), 'r') as file:
+        transcript = json.load(file)
+    text = extract_transcript_from_json(transcript)
+
+    host, port = server.server_address
+    engine = RefinementEngine(LlamaServerBackend("stub.gguf", host=host, port=port, launch=False),
+                              cache_size=0)
+    await engine.start()
+
+    from simli import Simli
+
+    stages = {
+        "extract_transcript": lambda: extract_transcript_from_json(transcript),
+        "clean_transcript": lambda: clean_transcript(transcript),
+        "refine": lambda: engine.refine(text, "Make it very funny", max_tokens=150, temperature=0.0),
+        "simli": lambda: Simli(text=text).get_video_url(),
+    }
+
+    if shutil.which("ffmpeg"):
+        video_path = os.path.join(tmp_dir, "video.mp4")
+        make_test_video(video_path)
+        pitch = Pitch(video_path=video_path)
+
+        def load_audio_file():
+            if os.path.exists(pitch.get_audio_path()):
+                os.remove(pitch.get_audio_path())
+            pitch.load_audio_file()
+
+        # The whole checkpointed pipeline, with a fresh work directory every run
+        BACKENDS[DeepgramStubBackend.name] = lambda: DeepgramStubBackend(rtt=0.0, realtime_factor=0.0)
+        runs = {"count": 0}
+
+        async def pipeline():
+            runs["count"] += 1
+            pipeline_pitch = Pitch(video_path=video_path, transcription_backend=DeepgramStubBackend.name,
+                                   llama_host=host, llama_port=port, launch_llama=False,
+                                   work_root=os.path.join(tmp_dir, f"work{runs['count']}"))
+            await pipeline_pitch.run_pipeline(render="simli")
+
+        stages["load_audio_file"] = load_audio_file
+        stages["pipeline"] = pipeline
+    else:
+        print("ffmpeg not found: skipping the load_audio_file and pipeline stages")
+
+    return stages, engine.stop
+
+
+async def call(stage):
+    # Stage progress messages would drown the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = stage()
+        if asyncio.iscoroutine(result):
+            result = await result
+    return result
+
+
+async def measure(stages, runs, warmup=1, memory_runs=7):
+    """
+    Time every stage `runs` times, then measure its peak Python allocations in
+    `memory_runs` separate traced runs so tracing does not slow down the timed runs.
+
+    :return: Dict of stage name to {"seconds": [...], "peak_alloc_bytes": [...]}
+    """
+    results = {}
+    for name, stage in stages.items():
+        for _ in range(warmup):
+            await call(stage)
+        seconds = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            await call(stage)
+            seconds.append(time.perf_counter() - start)
+
+        peaks = []
+        for _ in range(memory_runs):
+            tracemalloc.start()
+            await call(stage)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        results[name] = {"seconds": seconds, "peak_alloc_bytes": peaks}
+    return results
+
+
+def max_rss_kb():
+    """
+    :return: Peak resident set size of this process in KB, or None where unavailable
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def mann_whitney_u(baseline, candidate):
+    """
+    One-sided Mann-Whitney U test that `candidate` tends to be larger (slower) than
+    `baseline`, with the normal approximation, tie correction and continuity correction.
+
+    :return: (U statistic of the candidate, p-value)
+    """
+    n1, n2 = len(baseline), len(candidate)
+    combined = sorted([(value, 0) for value in baseline] + [(value, 1) for value in candidate])
+
+    # Average ranks over ties, and the tie term of the variance
+    ranks = [0.0] * len(combined)
+    tie_term = 0
+    i = 0
+    while i < len(combined):
+        j = i
+        while j + 1 < len(combined) and combined[j + 1][0] == combined[i][0]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2 + 1
+        tie_term += (j - i + 1) ** 3 - (j - i + 1)
+        i = j + 1
+
+    rank_sum = sum(rank for rank, (_, group) in zip(ranks, combined) if group == 1)
+    u = rank_sum - n2 * (n2 + 1) / 2
+    n = n1 + n2
+    variance = n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1)))
+    if variance <= 0:
+        return u, 1.0
+    z = (u - n1 * n2 / 2 - 0.5) / math.sqrt(variance)
+    return u, 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def compare(baseline, candidate, alpha=0.01, min_slowdown=0.05, memory_tolerance=0.10,
+            min_seconds=0.001, min_memory_bytes=64 * 1024):
+    """
+    Compare two recorded runs stage by stage. A stage regresses when its timings
+    are significantly larger (Mann-Whitney p < alpha) and its median is more than
+    `min_slowdown` and `min_seconds` slower, or when its peak allocations are
+    significantly larger and their median grew by more than `memory_tolerance`
+    and `min_memory_bytes`. The absolute floors keep noise on tiny stages from
+    failing the gate.
+
+    :return: List of row dicts, one per stage of the candidate
+    """
+    rows = []
+    for name, current in candidate["stages"].items():
+        previous = baseline["stages"].get(name)
+        row = {"stage": name, "median": statistics.median(current["seconds"]),
+               "peak_alloc_bytes": statistics.median(current["peak_alloc_bytes"]), "status": "new"}
+        if previous:
+            row["baseline_median"] = statistics.median(previous["seconds"])
+            row["change"] = row["median"] / row["baseline_median"] - 1
+            _, row["p_value"] = mann_whitney_u(previous["seconds"], current["seconds"])
+            baseline_peak = statistics.median(previous["peak_alloc_bytes"])
+            row["memory_change"] = row["peak_alloc_bytes"] / baseline_peak - 1 if baseline_peak else 0.0
+            _, row["memory_p_value"] = mann_whitney_u(previous["peak_alloc_bytes"], current["peak_alloc_bytes"])
+            slower = (row["p_value"] < alpha and row["change"] > min_slowdown
+                      and row["median"] - row["baseline_median"] >= min_seconds)
+            bigger = (row["memory_p_value"] < alpha and row["memory_change"] > memory_tolerance
+                      and row["peak_alloc_bytes"] - baseline_peak >= min_memory_bytes)
+            row["status"] = ("SLOWER" if slower else "") + (" MORE MEMORY" if bigger else "")
+            row["status"] = row["status"].strip() or ("faster" if row["change"] < -min_slowdown else "ok")
+        rows.append(row)
+    return rows
+
+
+def print_report(rows, baseline, candidate):
+    print(f"\nbaseline  {baseline['id']} ({baseline.get('commit') or '?'})")
+    print(f"candidate {candidate['id']} ({candidate.get('commit') or '?'})\n")
+    print(f"{'stage':<20}{'base ms':>10}{'now ms':>10}{'change':>9}{'p':>8}{'peak KB':>10}{'mem':>8}{'p':>8}  status")
+    for row in rows:
+        if "baseline_median" in row:
+            print(f"{row['stage']:<20}{row['baseline_median'] * 1000:>10.2f}{row['median'] * 1000:>10.2f}"
+                  f"{row['change']:>+9.1%}{row['p_value']:>8.3f}{row['peak_alloc_bytes'] / 1024:>10.0f}"
+                  f"{row['memory_change']:>+8.1%}{row['memory_p_value']:>8.3f}  {row['status']}")
+        else:
+            print(f"{row['stage']:<20}{'-':>10}{row['median'] * 1000:>10.2f}{'-':>9}{'-':>8}"
+                  f"{row['peak_alloc_bytes'] / 1024:>10.0f}{'-':>8}{'-':>8}  {row['status']}")
+    if baseline.get("maxrss_kb") and candidate.get("maxrss_kb"):
+        # One sample per process, so it is reported but not gated
+        print(f"\npeak RSS {baseline['maxrss_kb'] / 1024:.1f} MB -> {candidate['maxrss_kb'] / 1024:.1f} MB "
+              f"(informational)")
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return {"runs": []}
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def save_history(path, history):
+    with open(path, 'w') as file:
+        json.dump(history, file, indent=2)
+
+
+def find_run(history, run_id=None, baseline=False):
+    """
+    :return: The run with `run_id`, else the latest (baseline) run, or None
+    """
+    runs = [run for run in history["runs"] if not baseline or run.get("baseline")]
+    if run_id:
+        runs = [run for run in history["runs"] if run["id"] == run_id]
+    return runs[-1] if runs else None
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def record_run(args):
+    # Unthrottled stubs, so the limiter does not dominate the measurements
+    os.environ["PITCH_SIMLI_RPM"] = "0"
+    server = make_stub_server(args.stub_latency)
+    os.environ["SIMLI_URL"] = f"http://127.0.0.1:{server.server_port}/textToVideoStream"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        stages, cleanup = await build_stages(tmp_dir, server)
+        if args.stages:
+            stages = {name: stage for name, stage in stages.items() if name in args.stages}
+        try:
+            results = await measure(stages, args.runs, memory_runs=args.memory_runs)
+        finally:
+            await cleanup()
+            server.shutdown()
+
+    return {
+        "id": datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ"),
+        "commit": git_commit(),
+        "runs": args.runs,
+        "memory_runs": args.memory_runs,
+        "stub_latency": args.stub_latency,
+        "maxrss_kb": max_rss_kb(),
+        "baseline": False,
+        "stages": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage latency and memory regression gate")
+    parser.add_argument('--history', default=HISTORY_PATH, help='JSON history file')
+    parser.add_argument('--alpha', type=float, default=0.01, help='Significance level (default: 0.01)')
+    parser.add_argument('--min-slowdown', type=float, default=0.05,
+                        help='Smallest median slowdown reported as a regression (default: 0.05)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='Measure the stages, store the run and compare it to the baseline')
+    run_parser.add_argument('--runs', type=int, default=20, help='Timed runs per stage (default: 20)')
+    run_parser.add_argument('--memory-runs', type=int, default=7,
+                            help='Traced runs per stage for peak allocations (default: 7)')
+    run_parser.add_argument('--stub-latency', type=float, default=0.002,
+                            help='Latency of the llama/Simli stubs (default: 0.002s)')
+    run_parser.add_argument('--stages', nargs='+', help='Only run these stages')
+    run_parser.add_argument('--baseline', action='store_true', help='Store this run as the new baseline')
+    run_parser.add_argument('--no-save', action='store_true', help='Do not store this run')
+
+    compare_parser = commands.add_parser('compare', help='Compare two stored runs')
+    compare_parser.add_argument('--baseline', help='Baseline run id (default: latest baseline)')
+    compare_parser.add_argument('--candidate', help='Candidate run id (default: latest run)')
+    args = parser.parse_args()
+
+    history = load_history(args.history)
+    if args.command == 'run':
+        candidate = asyncio.run(record_run(args))
+        baseline = find_run(history, baseline=True)
+        # The first recorded run becomes the baseline
+        candidate["baseline"] = args.baseline or baseline is None
+        if not args.no_save:
+            history["runs"].append(candidate)
+            save_history(args.history, history)
+            print(f"Stored run {candidate['id']} in {args.history}")
+        baseline = baseline or candidate
+    else:
+        baseline = find_run(history, args.baseline, baseline=args.baseline is None)
+        candidate = find_run(history, args.candidate)
+        if baseline is None or candidate is None:
+            sys.exit("No matching runs in the history")
+
+    rows = compare(baseline, candidate, alpha=args.alpha, min_slowdown=args.min_slowdown)
+    print_report(rows, baseline, candidate)
+    regressions = [row["stage"] for row in rows if row["status"] not in ("ok", "faster", "new")]
+    if regressions:
+        print(f"\nRegressions in: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,4 @@
 import streamlit as st
-import requests
 from dotenv import load_dotenv
 import os, asyncio
 from pitch import Pitch
@@ -15,6 +14,9 @@ async def run(video_path: str):
     # Button to generate video
     if st.button("Generate Video"):
        hls_url = await pitch.get_new_video_urls()
+       # Replays are served from the local segment cache instead of the remote stream
+       from hls_cache import cache_hls
+       hls_url = await cache_hls(hls_url)
        video_html = f"""
     <link href="https://vjs.zencdn.net/7.11.4/video-js.css" rel="stylesheet" />
     <script src="https://vjs.zencdn.net/7.11.4/video.min.js"></script>
@@ -1,5 +1,4 @@
 import streamlit as st
-import requests
 from dotenv import load_dotenv
 import os
 
@@ -10,6 +9,15 @@ load_dotenv()
 elevenlabs_api_key = os.getenv("ELEVENLABS_API_KEY")
 simli_api_key = os.getenv("SIMLI_API_KEY")
 
+@st.cache_resource
+def get_session():
+    """
+    HTTP session shared across reruns, so `requests` is imported and the
+    connection pool to Simli is set up once per server process.
+    """
+    import requests
+    return requests.Session()
+
 # Streamlit app
 st.title("Text to Video Stream")
 
@@ -38,7 +46,7 @@ if st.button("Generate Video"):
     }
     headers = {"Content-Type": "application/json"}
 
-    response = requests.request("POST", url, json=payload, headers=headers)
+    response = get_session().request("POST", url, json=payload, headers=headers)
     response_data = response.json()
     print(response_data)
 
@@ -0,0 +1,405 @@
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import threading
+import posixpath
+from functools import partial
+from urllib.parse import urljoin, urlparse
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+_URI_ATTRIBUTE = re.compile(r'URI="([^"]+)"')
+
+
+class SegmentCache:
+    """
+    Content-addressed on-disk cache of HLS streams with least-recently-used eviction.
+
+    Segments are stored once per content hash under `objects/`, so the same bytes
+    fetched from different (e.g. re-signed) URLs are stored once. An index maps
+    source URLs to content hashes and records which objects and variant playlists
+    every cached playlist references. Eviction works on whole streams: the least
+    recently fetched top-level playlist is removed together with the objects no
+    remaining playlist references, so a served playlist never points at a missing segment.
+    """
+
+    def __init__(self, cache_dir="hls_cache", max_bytes=2 * 1024 ** 3):
+        """
+        :param cache_dir: Directory holding the cache, also the root served locally
+        :param max_bytes: Maximum total size of cached objects before eviction
+        """
+        self.cache_dir = cache_dir
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        self.playlists_dir = os.path.join(cache_dir, "playlists")
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.active_fetches = 0
+        # Objects stored by running fetches whose playlist is not recorded yet
+        self.unregistered = set()
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.playlists_dir, exist_ok=True)
+
+        self.index = {"urls": {}, "objects": {}, "playlists": {}}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as file:
+                self.index.update(json.load(file))
+
+    def _save_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(self.index, file)
+        os.replace(tmp_path, self.index_path)
+
+    def object_path(self, name):
+        return os.path.join(self.objects_dir, name)
+
+    def playlist_path(self, name):
+        return os.path.join(self.playlists_dir, name)
+
+    def get(self, url):
+        """
+        :param url: Source URL of the segment
+        :return: Cached object name, or None on a miss
+        """
+        with self.lock:
+            name = self.index["urls"].get(url)
+            if name is None or not os.path.exists(self.object_path(name)):
+                return None
+            self.index["objects"][name]["last_access"] = time.time()
+            return name
+
+    def put(self, url, content):
+        """
+        Store a segment. It is not evicted before the playlist referencing it is
+        recorded with add_playlist().
+
+        :param url: Source URL of the segment
+        :param content: Segment bytes
+        :return: Cached object name
+        """
+        extension = posixpath.splitext(urlparse(url).path)[1]
+        name = hashlib.sha256(content).hexdigest() + extension
+        path = self.object_path(name)
+        with self.lock:
+            if not os.path.exists(path):
+                tmp_path = path + ".tmp"
+                with open(tmp_path, 'wb') as file:
+                    file.write(content)
+                os.replace(tmp_path, path)
+            self.index["urls"][url] = name
+            self.index["objects"][name] = {"size": len(content), "last_access": time.time()}
+            self.unregistered.add(name)
+        return name
+
+    def add_playlist(self, name, objects, children=()):
+        """
+        Record a written playlist and what it references, then evict the least
+        recently used streams if over budget. The playlist itself is never evicted here.
+
+        :param name: File name of the playlist in `playlists/`
+        :param objects: Names of the objects it references
+        :param children: File names of the variant playlists it references
+        """
+        with self.lock:
+            self.index["playlists"][name] = {"objects": sorted(set(objects)),
+                                             "children": sorted(set(children)),
+                                             "last_access": time.time()}
+            self.unregistered.difference_update(objects)
+            self._evict(keep=name)
+
+    def cached_stream(self, name, require_end=True):
+        """
+        Check that a playlist and everything it references is cached, and mark it as used.
+
+        :param name: File name of the playlist in `playlists/`
+        :param require_end: Only accept streams whose media playlists are final (#EXT-X-ENDLIST)
+        :return: True if the playlist can be served from the cache
+        """
+        with self.lock:
+            playlists = self.index["playlists"]
+            if name not in playlists:
+                return False
+            names = self._closure([name])
+            for playlist in names:
+                entry = playlists[playlist]
+                if (not os.path.exists(self.playlist_path(playlist))
+                        or any(child not in playlists for child in entry["children"])
+                        or not all(os.path.exists(self.object_path(obj)) for obj in entry["objects"])):
+                    return False
+                if require_end and not entry["children"]:
+                    with open(self.playlist_path(playlist), 'r') as file:
+                        if "#EXT-X-ENDLIST" not in file.read():
+                            return False
+            now = time.time()
+            for playlist in names:
+                playlists[playlist]["last_access"] = now
+            return True
+
+    def begin_fetch(self):
+        with self.lock:
+            self.active_fetches += 1
+
+    def end_fetch(self):
+        with self.lock:
+            self.active_fetches -= 1
+            if self.active_fetches == 0:
+                # Anything still unregistered belongs to a failed fetch and may be evicted
+                self.unregistered.clear()
+
+    def _closure(self, names):
+        """
+        :return: The given playlists and every playlist they reference, recursively
+        """
+        playlists = self.index["playlists"]
+        seen, stack = set(), list(names)
+        while stack:
+            name = stack.pop()
+            if name in seen or name not in playlists:
+                continue
+            seen.add(name)
+            stack.extend(playlists[name]["children"])
+        return seen
+
+    def _evict(self, keep):
+        objects, playlists = self.index["objects"], self.index["playlists"]
+        total = sum(entry["size"] for entry in objects.values())
+        protected = self._closure([keep])
+
+        def referenced():
+            return {obj for entry in playlists.values() for obj in entry["objects"]}
+
+        def remove_objects(names):
+            nonlocal total
+            for obj in names:
+                if obj not in objects:
+                    continue
+                total -= objects.pop(obj)["size"]
+                if os.path.exists(self.object_path(obj)):
+                    os.remove(self.object_path(obj))
+
+        # Objects no playlist references (e.g. left from an aborted fetch) go first;
+        # segments of running fetches are kept until their playlist is recorded
+        in_use = referenced() | self.unregistered
+        for obj in sorted(objects, key=lambda n: objects[n]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            if obj not in in_use:
+                remove_objects([obj])
+
+        # Then whole streams, least recently fetched top-level playlist first
+        def roots():
+            children = {child for entry in playlists.values() for child in entry["children"]}
+            return [name for name in playlists if name not in children]
+
+        for root in sorted((r for r in roots() if r not in protected), key=lambda n: playlists[n]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            if root not in playlists:
+                continue
+            # Variant playlists shared with another stream stay
+            still_needed = self._closure([r for r in roots() if r != root] + [keep])
+            removed = self._closure([root]) - still_needed
+            dropped = set()
+            for name in removed:
+                dropped.update(playlists.pop(name)["objects"])
+                if os.path.exists(self.playlist_path(name)):
+                    os.remove(self.playlist_path(name))
+            remove_objects(sorted(dropped - referenced() - self.unregistered))
+
+        self.index["urls"] = {url: name for url, name in self.index["urls"].items() if name in objects}
+
+    def flush(self):
+        """
+        Persist the index; called once per fetch rather than once per segment.
+        """
+        with self.lock:
+            self._save_index()
+
+
+class HLSFetcher:
+    """
+    Download an HLS stream (master or media playlist) into a SegmentCache.
+
+    Segments are fetched concurrently over a pooled connection and playlists are
+    rewritten to reference the cached objects, so replays never touch the CDN.
+    """
+
+    def __init__(self, cache, max_connections=8, timeout=30.0, poll_timeout=300.0):
+        """
+        :param cache: SegmentCache to store segments in
+        :param max_connections: Maximum number of concurrent connections
+        :param timeout: Timeout of each HTTP request in seconds
+        :param poll_timeout: How long to keep polling a playlist still being generated
+        """
+        self.cache = cache
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.poll_timeout = poll_timeout
+
+    def _playlist_path(self, url):
+        return self.cache.playlist_path(hashlib.sha256(url.encode()).hexdigest()[:32] + ".m3u8")
+
+    async def fetch(self, playlist_url):
+        """
+        Download a playlist and everything it references.
+
+        :param playlist_url: URL of the master or media playlist
+        :return: Path of the rewritten local playlist, relative to the cache directory
+        """
+        import httpx
+
+        limits = httpx.Limits(max_connections=self.max_connections,
+                              max_keepalive_connections=self.max_connections)
+        self.cache.begin_fetch()
+        try:
+            async with httpx.AsyncClient(limits=limits, timeout=self.timeout,
+                                         follow_redirects=True) as client:
+                semaphore = asyncio.Semaphore(self.max_connections)
+                path = await self._fetch_playlist(client, semaphore, playlist_url)
+        finally:
+            self.cache.end_fetch()
+        self.cache.flush()
+        return os.path.relpath(path, self.cache.cache_dir)
+
+    async def _get_playlist(self, client, url):
+        """
+        Get a playlist, polling until it is complete if the stream is still being rendered.
+        """
+        deadline = time.monotonic() + self.poll_timeout
+        while True:
+            response = await client.get(url)
+            response.raise_for_status()
+            text = response.text
+            if "#EXT-X-STREAM-INF" in text or "#EXT-X-ENDLIST" in text or time.monotonic() > deadline:
+                return text
+            target = re.search(r"#EXT-X-TARGETDURATION:(\d+)", text)
+            await asyncio.sleep(int(target.group(1)) if target else 2)
+
+    async def _fetch_playlist(self, client, semaphore, url):
+        import httpx
+
+        path = self._playlist_path(url)
+        # A finished stream never changes, and its URL may have expired since it was cached
+        if self.cache.cached_stream(os.path.basename(path)):
+            return path
+        try:
+            text = await self._get_playlist(client, url)
+        except httpx.HTTPError:
+            if self.cache.cached_stream(os.path.basename(path), require_end=False):
+                print(f"Could not refresh {url}, serving the cached copy")
+                return path
+            raise
+        lines = text.splitlines()
+        is_master = "#EXT-X-STREAM-INF" in text
+
+        async def fetch_segment(segment_url):
+            name = self.cache.get(segment_url)
+            if name is not None:
+                return name
+            async with semaphore:
+                response = await client.get(segment_url)
+                response.raise_for_status()
+            return self.cache.put(segment_url, response.content)
+
+        async def localize(uri):
+            absolute = urljoin(url, uri)
+            if is_master:
+                # Variant playlists live next to this one
+                return os.path.basename(await self._fetch_playlist(client, semaphore, absolute))
+            return "../objects/" + await fetch_segment(absolute)
+
+        # Collect every URI (segment lines and URI="..." attributes) and fetch them together
+        uris = []
+        for line in lines:
+            if line and not line.startswith("#"):
+                uris.append(line.strip())
+            else:
+                uris.extend(_URI_ATTRIBUTE.findall(line))
+        unique = list(dict.fromkeys(uris))
+        local = dict(zip(unique, await asyncio.gather(*(localize(uri) for uri in unique))))
+
+        rewritten = []
+        for line in lines:
+            if line and not line.startswith("#"):
+                rewritten.append(local[line.strip()])
+            else:
+                rewritten.append(_URI_ATTRIBUTE.sub(lambda m: f'URI="{local[m.group(1)]}"', line))
+
+        with open(path, 'w') as file:
+            file.write("\n".join(rewritten) + "\n")
+        references = [local[uri] for uri in unique]
+        self.cache.add_playlist(
+            os.path.basename(path),
+            objects=[ref[len("../objects/"):] for ref in references if ref.startswith("../objects/")],
+            children=[ref for ref in references if not ref.startswith("../objects/")])
+        return path
+
+
+class _HLSRequestHandler(SimpleHTTPRequestHandler):
+    extensions_map = dict(SimpleHTTPRequestHandler.extensions_map, **{
+        ".m3u8": "application/vnd.apple.mpegurl",
+        ".ts": "video/mp2t",
+        ".m4s": "video/iso.segment",
+        ".aac": "audio/aac",
+    })
+
+    def end_headers(self):
+        # The Streamlit component iframe plays from a different origin
+        self.send_header("Access-Control-Allow-Origin", "*")
+        super().end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalHLSServer:
+    """
+    Serve a SegmentCache over HTTP from a background thread.
+    """
+
+    def __init__(self, cache, host="127.0.0.1", port=8765):
+        self.cache = cache
+        self.host = host
+        self.port = port
+        self.server = None
+
+    def start(self):
+        if self.server is None:
+            handler = partial(_HLSRequestHandler, directory=self.cache.cache_dir)
+            self.server = ThreadingHTTPServer((self.host, self.port), handler)
+            self.port = self.server.server_address[1]
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def url_for(self, local_playlist):
+        return f"http://{self.host}:{self.port}/{local_playlist}"
+
+
+# One cache and server per cache directory, shared by every fetch in the process
+_local_caches = {}
+
+
+async def cache_hls(hls_url, cache_dir="hls_cache", port=8765):
+    """
+    Download a rendered HLS stream into the local cache and return a local URL for it.
+
+    :param hls_url: Remote playlist URL (e.g. Simli's hls_url)
+    :param cache_dir: Cache directory
+    :param port: Port of the local static server
+    :return: Local playlist URL
+    """
+    if cache_dir not in _local_caches:
+        cache = SegmentCache(cache_dir)
+        _local_caches[cache_dir] = (cache, LocalHLSServer(cache, port=port).start())
+    cache, server = _local_caches[cache_dir]
+    local_playlist = await HLSFetcher(cache).fetch(hls_url)
+    return server.url_for(local_playlist)
@@ -0,0 +1,360 @@
+import os
+import time
+import bisect
+import asyncio
+import tempfile
+import statistics
+from typing import Optional
+import numpy as np
+from pydantic import BaseModel
+
+
+class LiveUtterance(BaseModel):
+    """
+    One final utterance of a live stream and its refinement. Times are seconds
+    in the audio stream (start/end) or perf_counter() readings (*_at); spoken_at
+    is when the source delivered the end of the utterance.
+    """
+    index: int
+    text: str
+    start: float
+    end: float
+    spoken_at: float = 0.0
+    transcribed_at: float = 0.0
+    refined_at: float = 0.0
+    refined_text: Optional[str] = None
+    error: Optional[str] = None
+
+    @property
+    def transcript_latency(self):
+        """Seconds from the end of the utterance being spoken to its final transcript."""
+        return self.transcribed_at - self.spoken_at
+
+    @property
+    def end_to_end_latency(self):
+        """Seconds from the end of the utterance being spoken to its refined text."""
+        return self.refined_at - self.spoken_at
+
+
+class AudioSource:
+    """
+    Base of the live sources. Every chunk is stamped when it arrives, so latency
+    is measured from the moment an utterance's audio was available; its position
+    in the stream only matches wall time for real-time sources.
+    """
+
+    def _start(self):
+        self.started = time.perf_counter()
+        self.received = 0
+        self.arrival_ends = []
+        self.arrival_times = []
+
+    def _arrived(self, chunk):
+        self.received += len(chunk)
+        self.arrival_ends.append(self.received / self.sample_rate)
+        self.arrival_times.append(time.perf_counter())
+
+    def arrived_at(self, seconds):
+        """
+        :param seconds: Position in the stream
+        :return: perf_counter() reading at which the audio up to `seconds` had arrived
+        """
+        index = bisect.bisect_left(self.arrival_ends, seconds)
+        return self.arrival_times[min(index, len(self.arrival_times) - 1)]
+
+
+class FileSource(AudioSource):
+    """
+    Stream a 16-bit PCM WAV file in fixed-size chunks, paced in real time so it
+    behaves like a live microphone (set realtime=False to replay as fast as possible).
+    """
+
+    def __init__(self, path, chunk_ms=100, realtime=True):
+        from vad import read_wav
+
+        self.samples, self.sample_rate = read_wav(path)
+        self.channels = self.samples.shape[1]
+        self.chunk_ms = chunk_ms
+        self.realtime = realtime
+        self.started = None
+
+    async def chunks(self):
+        """
+        :return: Async iterator of int16 arrays of shape (n, channels)
+        """
+        chunk_len = max(1, self.sample_rate * self.chunk_ms // 1000)
+        self._start()
+        for offset in range(0, len(self.samples), chunk_len):
+            chunk = self.samples[offset:offset + chunk_len]
+            if self.realtime:
+                # A chunk is available once its last sample has been "spoken"
+                delay = self.started + (offset + len(chunk)) / self.sample_rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            self._arrived(chunk)
+            yield chunk
+
+
+class MicrophoneSource(AudioSource):
+    """
+    Stream the default (or given) input device with sounddevice.
+    """
+
+    def __init__(self, sample_rate=16000, channels=1, chunk_ms=100, device=None, duration=None):
+        """
+        :param sample_rate: Capture sample rate in Hz
+        :param channels: Number of captured channels
+        :param chunk_ms: Chunk length in milliseconds
+        :param device: sounddevice input device, None for the default
+        :param duration: Seconds to capture, None to capture until cancelled
+        """
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.chunk_ms = chunk_ms
+        self.device = device
+        self.duration = duration
+        self.started = None
+
+    async def chunks(self):
+        import sounddevice
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        def callback(data, frames, time_info, status):
+            # Runs on the audio thread; hand a copy over to the event loop
+            loop.call_soon_threadsafe(queue.put_nowait, np.frombuffer(bytes(data), dtype=np.int16)
+                                      .reshape(-1, self.channels))
+
+        stream = sounddevice.RawInputStream(samplerate=self.sample_rate, channels=self.channels,
+                                            dtype='int16', device=self.device, callback=callback,
+                                            blocksize=self.sample_rate * self.chunk_ms // 1000)
+        captured = 0
+        with stream:
+            self._start()
+            while self.duration is None or captured < self.duration * self.sample_rate:
+                chunk = await queue.get()
+                captured += len(chunk)
+                self._arrived(chunk)
+                yield chunk
+
+
+class LocalStreamingTranscriber:
+    """
+    Local stand-in for a streaming transcription service. An energy endpointer
+    cuts the stream into utterances at pauses, and each utterance is transcribed
+    by a prerecorded backend (faster-whisper by default) while the next one is
+    still being captured.
+    """
+
+    def __init__(self, backend="faster-whisper", threshold_dbfs=-45.0, frame_ms=30,
+                 endpoint_ms=600, min_speech_ms=250, max_utterance_seconds=15.0):
+        """
+        :param backend: Name of the TranscriptionBackend used per utterance
+        :param threshold_dbfs: Frames louder than this (dB below full scale) are speech
+        :param frame_ms: Endpointer frame length in milliseconds
+        :param endpoint_ms: Silence that ends an utterance
+        :param min_speech_ms: Shorter bursts of sound are dropped as noise
+        :param max_utterance_seconds: Utterances are cut at this length even without a pause
+        """
+        self.backend = backend
+        self.threshold_dbfs = threshold_dbfs
+        self.frame_ms = frame_ms
+        self.endpoint_ms = endpoint_ms
+        self.min_speech_ms = min_speech_ms
+        self.max_utterance_seconds = max_utterance_seconds
+
+    async def _segment(self, source, segments):
+        """
+        Push (start seconds, int16 samples) of every utterance of the source into `segments`.
+        """
+        frame_len = max(1, source.sample_rate * self.frame_ms // 1000)
+        endpoint_frames = self.endpoint_ms // self.frame_ms
+        min_speech_frames = self.min_speech_ms // self.frame_ms
+        max_frames = int(self.max_utterance_seconds * 1000 // self.frame_ms)
+
+        pending = np.zeros((0, source.channels), dtype=np.int16)
+        frames, speech_frames, silence_run, position = [], 0, 0, 0
+
+        def flush():
+            if speech_frames >= min_speech_frames:
+                audio = np.concatenate(frames[:len(frames) - silence_run + 1])
+                segments.put_nowait(((position - len(frames)) * frame_len / source.sample_rate, audio))
+
+        async for chunk in source.chunks():
+            pending = np.concatenate([pending, chunk])
+            n_frames = len(pending) // frame_len
+            if n_frames == 0:
+                continue
+            block = pending[:n_frames * frame_len].reshape(n_frames, frame_len, source.channels)
+            pending = pending[n_frames * frame_len:]
+            rms = np.sqrt(np.mean(block.astype(np.float32) ** 2, axis=(1, 2))) / 32768.0
+            is_speech = 20 * np.log10(np.maximum(rms, 1e-9)) > self.threshold_dbfs
+
+            for frame, speech in zip(block, is_speech):
+                position += 1
+                if not frames and not speech:
+                    continue
+                frames.append(frame)
+                speech_frames += int(speech)
+                silence_run = 0 if speech else silence_run + 1
+                if silence_run >= endpoint_frames or len(frames) >= max_frames:
+                    flush()
+                    frames, speech_frames, silence_run = [], 0, 0
+        flush()
+        segments.put_nowait(None)
+
+    def _transcribe(self, audio, sample_rate):
+        from vad import write_wav
+        from trancription import get_backend
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "utterance.wav")
+            write_wav(path, audio, sample_rate)
+            response = get_backend(self.backend).transcribe_file(path)
+        return response['results']['channels'][0]['alternatives'][0]['transcript']
+
+    async def utterances(self, source):
+        """
+        :param source: FileSource or MicrophoneSource
+        :return: Async iterator of (text, start seconds, end seconds) of final utterances
+        """
+        segments = asyncio.Queue()
+        segmenter = asyncio.create_task(self._segment(source, segments))
+        try:
+            while (segment := await segments.get()) is not None:
+                start, audio = segment
+                text = await asyncio.to_thread(self._transcribe, audio, source.sample_rate)
+                if text.strip():
+                    yield text.strip(), start, start + len(audio) / source.sample_rate
+            await segmenter
+        finally:
+            segmenter.cancel()
+
+
+class DeepgramLiveTranscriber:
+    """
+    Deepgram streaming transcription over its live websocket. Final results are
+    collected until Deepgram marks the end of speech, then emitted as one utterance.
+    """
+
+    def __init__(self, api_key=None, model="nova-2", endpointing_ms=300, utterance_end_ms=1000):
+        """
+        :param api_key: Deepgram API key, defaults to the DEEPGRAM environment variable
+        :param model: Deepgram model name
+        :param endpointing_ms: Silence after which Deepgram finalizes speech
+        :param utterance_end_ms: Gap in words after which Deepgram sends UtteranceEnd
+        """
+        self.api_key = api_key or os.getenv("DEEPGRAM")
+        self.model = model
+        self.endpointing_ms = endpointing_ms
+        self.utterance_end_ms = utterance_end_ms
+
+    async def utterances(self, source):
+        from deepgram import DeepgramClient, LiveOptions, LiveTranscriptionEvents
+        from rate_limit import get_limiter
+
+        queue = asyncio.Queue()
+        parts = []
+
+        def flush():
+            if parts:
+                text = " ".join(part["text"] for part in parts)
+                queue.put_nowait((text, parts[0]["start"], parts[-1]["end"]))
+                parts.clear()
+
+        async def on_transcript(connection, result, **kwargs):
+            alternative = result.channel.alternatives[0]
+            if result.is_final and alternative.transcript:
+                parts.append({"text": alternative.transcript, "start": result.start,
+                              "end": result.start + result.duration})
+            if result.speech_final:
+                flush()
+
+        async def on_utterance_end(connection, utterance_end, **kwargs):
+            flush()
+
+        connection = DeepgramClient(api_key=self.api_key).listen.asyncwebsocket.v("1")
+        connection.on(LiveTranscriptionEvents.Transcript, on_transcript)
+        connection.on(LiveTranscriptionEvents.UtteranceEnd, on_utterance_end)
+
+        options = LiveOptions(model=self.model, encoding="linear16", sample_rate=source.sample_rate,
+                              channels=source.channels, smart_format=True, interim_results=True,
+                              endpointing=self.endpointing_ms, utterance_end_ms=str(self.utterance_end_ms))
+        # Opening a stream counts as one request against the Deepgram budget
+        await get_limiter("deepgram").acquire_async()
+        if not await connection.start(options):
+            from resilience import ServiceError
+            raise ServiceError("deepgram", "could not open the live transcription websocket")
+
+        async def send():
+            try:
+                async for chunk in source.chunks():
+                    await connection.send(chunk.tobytes())
+            finally:
+                await connection.finish()
+                flush()
+                queue.put_nowait(None)
+
+        sender = asyncio.create_task(send())
+        try:
+            while (utterance := await queue.get()) is not None:
+                yield utterance
+            await sender
+        finally:
+            sender.cancel()
+
+
+def get_live_transcriber(name="deepgram"):
+    """
+    :param name: 'deepgram' for the live websocket, otherwise the name of a local
+        TranscriptionBackend used behind the local endpointer
+    :return: Streaming transcriber
+    """
+    if name == "deepgram":
+        return DeepgramLiveTranscriber()
+    return LocalStreamingTranscriber(backend=name)
+
+
+async def refine_live(source, transcriber, engine, instruction, on_result=None):
+    """
+    Refine a live stream utterance by utterance. Each final utterance is sent to
+    the (already started) engine as soon as it is transcribed, so refinements
+    overlap with capturing and transcribing the rest of the stream.
+
+    :param source: FileSource or MicrophoneSource
+    :param transcriber: LocalStreamingTranscriber or DeepgramLiveTranscriber
+    :param engine: Started RefinementEngine
+    :param instruction: Full refinement instruction
+    :param on_result: Optional callback called with each LiveUtterance when it is refined
+    :return: List of LiveUtterance, in spoken order
+    """
+    from resilience import ServiceError
+
+    async def refine(utterance):
+        try:
+            utterance.refined_text = await engine.refine(utterance.text, instruction)
+        except ServiceError as e:
+            utterance.error = str(e)
+        utterance.refined_at = time.perf_counter()
+        if on_result:
+            on_result(utterance)
+        return utterance
+
+    tasks = []
+    async for text, start, end in transcriber.utterances(source):
+        utterance = LiveUtterance(index=len(tasks), text=text, start=start, end=end,
+                                  spoken_at=source.arrived_at(end), transcribed_at=time.perf_counter())
+        tasks.append(asyncio.create_task(refine(utterance)))
+    return list(await asyncio.gather(*tasks))
+
+
+def print_latency_report(utterances):
+    print(f"{'#':>3}{'end s':>8}{'transcript s':>14}{'end-to-end s':>14}  refined")
+    for utterance in utterances:
+        print(f"{utterance.index:>3}{utterance.end:>8.2f}{utterance.transcript_latency:>14.2f}"
+              f"{utterance.end_to_end_latency:>14.2f}  {utterance.refined_text or utterance.error}")
+    latencies = [utterance.end_to_end_latency for utterance in utterances]
+    if len(latencies) >= 2:
+        print(f"end-to-end p50 {statistics.median(latencies):.2f}s, "
+              f"max {max(latencies):.2f}s over {len(latencies)} utterances")
@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import hashlib
+
+def hash_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_values(*values):
+    """
+    :param values: JSON-serializable values
+    :return: sha256 of their canonical JSON encoding
+    """
+    return hashlib.sha256(json.dumps(values, sort_keys=True).encode()).hexdigest()
+
+
+class PipelineState:
+    """
+    Per-video work directory with a manifest of completed stages.
+
+    Every completed stage records the hash of its inputs (upstream output hash and
+    stage parameters), its output files and the hash of those outputs. A stage is
+    reused on the next run only if its input hash matches and its outputs still
+    exist, so reruns resume from the first invalid stage. Since each input hash
+    includes the output hash of the stage before it, changing one stage
+    invalidates every stage after it and nothing before it.
+    """
+
+    def __init__(self, video_path, root="work"):
+        """
+        :param video_path: Path to the input video
+        :param root: Directory holding the work directories of all videos
+        """
+        self.video_path = os.path.abspath(video_path)
+        stem = os.path.splitext(os.path.basename(video_path))[0]
+        self.work_dir = os.path.join(root, f"{stem}-{hash_values(self.video_path)[:12]}")
+        self.manifest_path = os.path.join(self.work_dir, "manifest.json")
+        os.makedirs(self.work_dir, exist_ok=True)
+
+        self.manifest = {"video": self.video_path, "stages": {}}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r') as file:
+                self.manifest = json.load(file)
+
+    def _save(self):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(self.manifest, file, indent=4)
+        os.replace(tmp_path, self.manifest_path)
+
+    def path(self, name):
+        return os.path.join(self.work_dir, name)
+
+    def video_hash(self):
+        """
+        Hash of the input video, recomputed only when its size or mtime changes.
+        """
+        stat = os.stat(self.video_path)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        cached = self.manifest.get("video_hash")
+        if cached is None or cached["signature"] != signature:
+            cached = {"signature": signature, "sha256": hash_file(self.video_path)}
+            self.manifest["video_hash"] = cached
+            self._save()
+        return cached["sha256"]
+
+    def output_hash(self, stage):
+        return self.manifest["stages"][stage]["output_hash"]
+
+    def is_valid(self, stage, input_hash):
+        """
+        :param stage: Stage name
+        :param input_hash: Hash of the stage inputs for this run
+        :return: True if the stored output can be reused
+        """
+        entry = self.manifest["stages"].get(stage)
+        return (entry is not None
+                and entry["input_hash"] == input_hash
+                and all(os.path.exists(self.path(name)) for name in entry["outputs"]))
+
+    def complete(self, stage, input_hash, outputs, seconds=None):
+        """
+        Record a completed stage.
+
+        :param stage: Stage name
+        :param input_hash: Hash of the stage inputs
+        :param outputs: Names of the output files in the work directory
+        :param seconds: Time the stage took
+        """
+        self.manifest["stages"][stage] = {
+            "input_hash": input_hash,
+            "outputs": list(outputs),
+            "output_hash": hash_values(*(hash_file(self.path(name)) for name in outputs)),
+            "completed": time.time(),
+            "seconds": seconds,
+        }
+        self._save()
+
+    async def run_stage(self, stage, upstream_hash, params, run):
+        """
+        Run a stage unless a valid checkpoint exists.
+
+        :param stage: Stage name
+        :param upstream_hash: Output hash of the previous stage (or of the video)
+        :param params: JSON-serializable parameters that change the stage output
+        :param run: Callable (sync or async) producing the stage outputs and
+            returning their file names in the work directory; it must raise on failure
+            so that nothing is checkpointed
+        :return: Output hash of the stage
+        """
+        input_hash = hash_values(stage, upstream_hash, params)
+        if self.is_valid(stage, input_hash):
+            print(f"Reusing checkpointed {stage} stage")
+            return self.output_hash(stage)
+
+        start = time.perf_counter()
+        outputs = run()
+        if hasattr(outputs, "__await__"):
+            outputs = await outputs
+        self.complete(stage, input_hash, outputs, time.perf_counter() - start)
+        return self.output_hash(stage)
+
+    def write_json(self, name, data):
+        with open(self.path(name), 'w') as file:
+            json.dump(data, file, indent=4)
+        return name
+
+    def read_json(self, name):
+        with open(self.path(name), 'r') as file:
+            return json.load(file)
@@ -1,13 +1,41 @@
 import subprocess
-import os, asyncio, json
+import os, asyncio, json, time
+from contextlib import asynccontextmanager
+from typing import Optional
 from pydantic import BaseModel
-from trancription import Transcriber
-from simli import Simli
-from refinePitchText2 import refinePitch
+
+# Stage dependencies (Deepgram, httpx, requests, NumPy, the refinement engine) are
+# imported inside the methods that use them, so importing Pitch - and every
+# Streamlit rerun - stays cheap and each SDK only loads when its stage runs.
+
+class PitchVariant(BaseModel):
+    """
+    One refinement + render of a video produced by Pitch.run_variants.
+    Timings are wall seconds of this run; checkpointed stages take ~0.
+    """
+    instruction: str
+    key: str
+    refined_text: Optional[str] = None
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    shared_seconds: float = 0.0
+    refine_seconds: float = 0.0
+    render_seconds: float = 0.0
+
 
 class Pitch(BaseModel):
     
     video_path: str
+    transcription_backend: str = "deepgram"
+    trim_silence: bool = False
+    clean_transcript: bool = True
+    refinement_backend: str = "llama"
+    model_path: str = "/home/znasif/llama.cpp/models/Llama-3.1.gguf"
+    llama_host: str = "127.0.0.1"
+    llama_port: int = 8080
+    launch_llama: bool = True
+    instruction: str = "Make it very funny"
+    work_root: str = "work"
 
     def get_audio_path(self):
         video_extension = self.video_path.split(".")[-1]
@@ -18,35 +46,419 @@ class Pitch(BaseModel):
         audio_path = self.get_audio_path()
         if os.path.exists(audio_path):
             return
-        
-        command = f"ffmpeg -i {self.video_path} -ab 160k -ac 2 -ar 44100 -vn {audio_path}"
-        subprocess.call(command, shell=True)
+        self._extract_audio(audio_path)
 
-    def get_transcription(self):
-        self.load_audio_file()
+    async def aload_audio_file(self):
+        """
+        Same as load_audio_file() without blocking the event loop.
+        """
         audio_path = self.get_audio_path()
-        transcriber = Transcriber(audo_file_path=audio_path)
-        return transcriber.transcribe()
+        if os.path.exists(audio_path):
+            return
+        await self._aextract_audio(audio_path)
+
+    def _extract_audio_command(self, audio_path, threads):
+        return ["ffmpeg", "-y", "-i", self.video_path, "-threads", str(threads),
+                "-ab", "160k", "-ac", "2", "-ar", "44100", "-vn", audio_path]
+
+    def _check_extracted(self, returncode, audio_path):
+        if returncode != 0 or not os.path.exists(audio_path):
+            raise RuntimeError(f"ffmpeg could not extract audio from {self.video_path}")
+
+    def _extract_audio(self, audio_path):
+        from resource_governor import get_governor
+
+        # Wait for a thread budget so parallel jobs do not oversubscribe the cores
+        with get_governor().lease("ffmpeg", name=self.video_path) as lease:
+            returncode = subprocess.call(self._extract_audio_command(audio_path, lease.threads))
+        self._check_extracted(returncode, audio_path)
+
+    async def _aextract_audio(self, audio_path):
+        from resource_governor import get_governor
+
+        async with get_governor().alease("ffmpeg", name=self.video_path) as lease:
+            process = await asyncio.create_subprocess_exec(*self._extract_audio_command(audio_path, lease.threads))
+            try:
+                returncode = await process.wait()
+            except asyncio.CancelledError:
+                process.kill()
+                raise
+        self._check_extracted(returncode, audio_path)
+
+    def get_trimmed_audio_path(self):
+        return self.get_audio_path()[:-len(".wav")] + ".trimmed.wav"
+
+    def get_offset_map_path(self):
+        return self.get_audio_path()[:-len(".wav")] + ".offsets.json"
+
+    def load_trimmed_audio_file(self):
+        """
+        Drop long silences from the extracted audio so less audio is uploaded and
+        transcribed. Returns the map from trimmed back to original timestamps.
+        """
+        from vad import TimeOffsetMap
+
+        self.load_audio_file()
+        trimmed_path = self.get_trimmed_audio_path()
+        offset_map_path = self.get_offset_map_path()
+        if os.path.exists(trimmed_path) and os.path.exists(offset_map_path):
+            return TimeOffsetMap.load(offset_map_path)
+
+        offset_map = self._trim_silence(self.get_audio_path(), trimmed_path)
+        offset_map.save(offset_map_path)
+        return offset_map
+
+    def _trim_silence(self, audio_path, trimmed_path):
+        from vad import trim_silence as trim_audio_silence
+        from resource_governor import get_governor
+
+        # Decoded PCM, its float copy and the trimmed copy are all held in memory
+        buffer_bytes = 4 * os.path.getsize(audio_path)
+        with get_governor().lease("vad", memory=buffer_bytes, name=self.video_path):
+            return trim_audio_silence(audio_path, trimmed_path)
+
+    def get_transcription(self):
+        from trancription import Transcriber
+
+        if not self.trim_silence:
+            self.load_audio_file()
+            audio_path = self.get_audio_path()
+            transcriber = Transcriber(audo_file_path=audio_path, backend=self.transcription_backend)
+            return transcriber.transcribe()
+
+        from vad import remap_transcript_timestamps
+
+        offset_map = self.load_trimmed_audio_file()
+        transcriber = Transcriber(audo_file_path=self.get_trimmed_audio_path(), backend=self.transcription_backend)
+        # Word timestamps must refer to the original video, not the trimmed audio
+        transcript = remap_transcript_timestamps(json.loads(transcriber.transcribe()), offset_map)
+        return json.dumps(transcript, indent=4)
+
+    def get_refinement_engine(self, threads=None):
+        """
+        :param threads: Threads a local backend leases, None for its default
+        """
+        from refinement_engine import RefinementEngine, create_backend
+
+        backend_kwargs = {
+            "llama": {"model_path": self.model_path, "host": self.llama_host, "port": self.llama_port,
+                      "launch": self.launch_llama, "threads": threads},
+            "llama-cpp-python": {"model_path": self.model_path, "n_threads": threads},
+            "llama-cpp-pool": {"model_path": self.model_path, "threads": threads},
+            "openai": {},
+        }
+        return RefinementEngine(create_backend(self.refinement_backend,
+                                               **backend_kwargs.get(self.refinement_backend, {})))
+
+    async def refine_transcript(self, transcript, instruction=None, structured=False):
+        """
+        Refine a Deepgram transcript with the refinement engine. Backend failures
+        raise ServiceError; an empty transcript or refinement raises RuntimeError
+        rather than passing the original text on as the refined one.
+        """
+        from refinement_engine import LENGTH_SUFFIX, extract_transcript_from_json
+
+        text = extract_transcript_from_json(transcript, clean=self.clean_transcript)
+        if text is None:
+            raise RuntimeError("Transcript has no text to refine")
+        instruction = (instruction or self.instruction) + LENGTH_SUFFIX
+        async with self.get_refinement_engine() as engine:
+            if structured:
+                refinement = await engine.refine_structured(text, instruction)
+            else:
+                refinement = await engine.refine(text, instruction)
+        if not refinement:
+            raise RuntimeError(f"The {self.refinement_backend} backend returned an empty refinement")
+        return refinement
 
     async def improve_transcription(self):
-        transcript = json.loads(self.get_transcription())
-        text = await refinePitch(transcript, "/home/znasif/llama.cpp/models/Llama-3.1.gguf", 8080, "Make it very funny")
-        self.create_new_video(text)
+        transcript = json.loads(await asyncio.to_thread(self.get_transcription))
+        text = await self.refine_transcript(transcript)
+        await asyncio.to_thread(self.create_new_video, text)
 
     def create_new_video(self, text):
+        from simli import Simli
+
         return Simli(text=text).get_video_url()
     
-    async def get_new_video_urls(self):
-        transcript = json.loads(self.get_transcription())
+    def create_local_video(self, transcript, refinement, output_path=None):
+        """
+        Re-dub the original video locally instead of rendering a Simli avatar.
+        Only the spans of the changed segments are re-encoded.
+        """
+        from redub import Redubber
+
+        words = transcript['results']['channels'][0]['alternatives'][0]['words']
+        work_dir = os.path.splitext(self.video_path)[0] + "_redub"
+        return Redubber(video_path=self.video_path, work_dir=work_dir).render(
+            words, refinement['segments'], output_path)
+
+    async def get_redubbed_video(self, output_path=None):
+        transcript = json.loads(await asyncio.to_thread(self.get_transcription))
         print("Transcription done")
-        text = await refinePitch(transcript, "/home/znasif/llama.cpp/models/Llama-3.1.gguf", 8080, "Make it very funny")
-        print(text)
-        new_video_urls = Simli(text=text).get_video_url()
-        return new_video_urls
+        refinement = await self.refine_transcript(transcript, structured=True)
+        print(refinement['refined_text'])
+        return await asyncio.to_thread(self.create_local_video, transcript, refinement, output_path)
+    
+    async def _run_shared_stages(self, state):
+        """
+        Run (or reuse) the audio, transcript and cleaned stages of a work directory.
+
+        :param state: PipelineState of the video
+        :return: Output hash of the cleaned stage
+        """
+        from refinement_engine import extract_transcript_from_json
+        from trancription import get_backend
+
+        async def extract_audio():
+            await self._aextract_audio(state.path("audio.wav"))
+            return ["audio.wav"]
+
+        def transcribe_sync():
+            backend = get_backend(self.transcription_backend)
+            if not self.trim_silence:
+                return [state.write_json("transcript.json", backend.transcribe_file(state.path("audio.wav")))]
+
+            from vad import remap_transcript_timestamps
+
+            offset_map = self._trim_silence(state.path("audio.wav"), state.path("audio.trimmed.wav"))
+            offset_map.save(state.path("offsets.json"))
+            transcript = remap_transcript_timestamps(
+                backend.transcribe_file(state.path("audio.trimmed.wav")), offset_map)
+            return [state.write_json("transcript.json", transcript), "offsets.json"]
+
+        async def transcribe():
+            # Uploads and local models block, so keep them off the event loop
+            return await asyncio.to_thread(transcribe_sync)
+
+        def clean():
+            text = extract_transcript_from_json(state.read_json("transcript.json"), clean=self.clean_transcript)
+            if text is None:
+                raise RuntimeError("Transcript has no text to refine")
+            return [state.write_json("cleaned.json", {"text": text})]
+
+        upstream = await state.run_stage("audio", state.video_hash(), ["160k", 2, 44100], extract_audio)
+        upstream = await state.run_stage("transcript", upstream,
+                                         [self.transcription_backend, self.trim_silence], transcribe)
+        return await state.run_stage("cleaned", upstream, [self.clean_transcript], clean)
+
+    @asynccontextmanager
+    async def _lazy_engine(self):
+        """
+        Yield a coroutine function returning a started refinement engine. The engine
+        (and a llama-server) is only started if some refinement is not checkpointed.
+        """
+        engine = self.get_refinement_engine()
+        lock = asyncio.Lock()
+        started = False
+
+        async def get_engine():
+            nonlocal started
+            async with lock:
+                if not started:
+                    await engine.start()
+                    started = True
+            return engine
+
+        try:
+            yield get_engine
+        finally:
+            if started:
+                await engine.stop()
+
+    async def _refine_stage(self, state, upstream, instruction, structured, get_engine, name="refined"):
+        """
+        :param instruction: Full refinement instruction
+        :param structured: Ask for per-segment output, needed by the local re-dub
+        :param get_engine: Coroutine function returning a started RefinementEngine
+        :param name: Stage name, also the name of the output JSON
+        :return: Output hash of the stage
+        """
+        async def refine():
+            text = state.read_json("cleaned.json")["text"]
+            engine = await get_engine()
+            # Backend failures raise ServiceError; only unparseable structured output is None
+            if structured:
+                refinement = await engine.refine_structured(text, instruction)
+                if refinement is None:
+                    raise RuntimeError(f"The {self.refinement_backend} backend returned an invalid refinement")
+            else:
+                refined_text = await engine.refine(text, instruction)
+                if not refined_text:
+                    raise RuntimeError(f"The {self.refinement_backend} backend returned an empty refinement")
+                refinement = {"refined_text": refined_text}
+            return [state.write_json(f"{name}.json", refinement)]
+
+        return await state.run_stage(name, upstream,
+                                     [self.refinement_backend, self.model_path, instruction, structured],
+                                     refine)
+
+    async def _render_stage(self, state, upstream, render, refined_name="refined", name="render"):
+        """
+        :param render: 'simli' for an avatar video or 'local' to re-dub the original video
+        :param refined_name: Name of the refinement stage to render
+        :param name: Stage name, also the name of the output JSON
+        :return: Output hash of the stage
+        """
+        async def render_video():
+            refinement = state.read_json(f"{refined_name}.json")
+            if render == "local":
+                from redub import Redubber
+
+                words = state.read_json("transcript.json")['results']['channels'][0]['alternatives'][0]['words']
+                redubber = Redubber(video_path=self.video_path, work_dir=state.path("redub"))
+                video_path = await asyncio.to_thread(redubber.render, words, refinement['segments'],
+                                                     state.path(f"{name}.mp4"))
+                # The video is checkpointed too, so a deleted render is redone
+                return [state.write_json(f"{name}.json", {"video_path": video_path}), f"{name}.mp4"]
+
+            hls_url = await asyncio.to_thread(self.create_new_video, refinement['refined_text'])
+            return [state.write_json(f"{name}.json", {"hls_url": hls_url})]
+
+        return await state.run_stage(name, upstream, [render], render_video)
+
+    async def run_pipeline(self, instruction=None, render="simli"):
+        """
+        Run the whole pipeline with every stage checkpointed in a per-video work
+        directory. A rerun reuses each stage whose inputs are unchanged and resumes
+        from the first invalid one; a failing stage raises instead of passing the
+        original transcript on as the refined one.
+
+        :param instruction: Refinement instruction, defaults to self.instruction
+        :param render: 'simli' for an avatar video or 'local' to re-dub the original video
+        :return: Render result, {"hls_url": ...} for Simli or {"video_path": ...} for local
+        """
+        from pipeline_state import PipelineState
+        from refinement_engine import LENGTH_SUFFIX
+
+        state = PipelineState(self.video_path, root=self.work_root)
+        instruction = (instruction or self.instruction) + LENGTH_SUFFIX
+
+        upstream = await self._run_shared_stages(state)
+        async with self._lazy_engine() as get_engine:
+            upstream = await self._refine_stage(state, upstream, instruction, render == "local", get_engine)
+        await self._render_stage(state, upstream, render)
+        print(state.read_json("refined.json")['refined_text'])
+        return state.read_json("render.json")
+
+    async def run_variants(self, instructions=None, max_renders=2, render="simli"):
+        """
+        A/B generation: refine one video with several instructions and render every
+        variant. Extraction and transcription run once, the refinements run
+        concurrently on one engine, which is stopped before the renders start, and
+        at most `max_renders` renders are in flight.
+        Every variant is checkpointed, so a rerun only redoes the variants that failed.
+
+        :param instructions: Refinement instructions, defaults to the built-in
+            INSTRUCTIONS plus self.instruction
+        :param max_renders: Maximum number of concurrent renders
+        :param render: 'simli' for avatar videos or 'local' to re-dub the original video
+        :return: List of PitchVariant, in the order of `instructions`
+        """
+        from pipeline_state import PipelineState, hash_values
+        from refinement_engine import INSTRUCTIONS, LENGTH_SUFFIX
+
+        if instructions is None:
+            instructions = INSTRUCTIONS + [self.instruction]
+        state = PipelineState(self.video_path, root=self.work_root)
+
+        start = time.perf_counter()
+        upstream = await self._run_shared_stages(state)
+        shared_seconds = time.perf_counter() - start
+
+        variants = [PitchVariant(instruction=instruction, key=hash_values(instruction)[:12],
+                                 shared_seconds=shared_seconds) for instruction in instructions]
+        refined = {}
+
+        async def refine_variant(variant, get_engine):
+            try:
+                start = time.perf_counter()
+                refined[variant.key] = await self._refine_stage(
+                    state, upstream, variant.instruction + LENGTH_SUFFIX, render == "local", get_engine,
+                    name=f"refined-{variant.key}")
+                variant.refine_seconds = time.perf_counter() - start
+                variant.refined_text = state.read_json(f"refined-{variant.key}.json")['refined_text']
+            except Exception as e:
+                # One failing variant must not throw away the others
+                print(f"Variant '{variant.instruction}' failed: {e}")
+                variant.error = str(e)
+
+        render_semaphore = asyncio.Semaphore(max_renders)
+
+        async def render_variant(variant):
+            try:
+                async with render_semaphore:
+                    start = time.perf_counter()
+                    await self._render_stage(state, refined[variant.key], render,
+                                             refined_name=f"refined-{variant.key}", name=f"render-{variant.key}")
+                    variant.render_seconds = time.perf_counter() - start
+                variant.result = state.read_json(f"render-{variant.key}.json")
+            except Exception as e:
+                print(f"Variant '{variant.instruction}' failed: {e}")
+                variant.error = str(e)
+
+        # The engine holds its llama thread lease until it stops, and renders lease
+        # ffmpeg threads, so stop it before rendering instead of overlapping the two
+        async with self._lazy_engine() as get_engine:
+            await asyncio.gather(*(refine_variant(variant, get_engine) for variant in variants))
+        await asyncio.gather(*(render_variant(variant) for variant in variants if variant.error is None))
+        return variants
+
+    async def run_live(self, microphone=False, instruction=None, realtime=True, on_result=None):
+        """
+        Live mode: stream audio in real-time chunks to a streaming transcriber and
+        refine every final utterance as soon as it arrives. Deepgram uses its live
+        websocket; any other transcription backend runs behind a local endpointer.
+
+        :param microphone: Capture the microphone instead of replaying the video's audio
+        :param instruction: Refinement instruction, defaults to self.instruction
+        :param realtime: Pace the replayed audio in real time
+        :param on_result: Optional callback called with each LiveUtterance when it is refined
+        :return: List of LiveUtterance with per-utterance latencies
+        """
+        from live import FileSource, MicrophoneSource, get_live_transcriber, refine_live, print_latency_report
+        from refinement_engine import LENGTH_SUFFIX
+
+        # The engine holds its lease for the whole stream while a local transcriber leases
+        # threads per utterance, so leave the transcriber its share or both wait forever
+        engine_threads = None
+        leases_threads = (self.refinement_backend in ("llama-cpp-python", "llama-cpp-pool")
+                          or (self.refinement_backend == "llama" and self.launch_llama))
+        if leases_threads and self.transcription_backend != "deepgram":
+            from resource_governor import get_governor
+            from trancription import get_backend
+
+            engine_threads = get_governor().cpu_budget - get_backend(self.transcription_backend).leased_threads()
+            if engine_threads < 1:
+                raise RuntimeError(f"Live mode with {self.transcription_backend} needs a CPU budget of at least "
+                                   f"2 threads (PITCH_CPU_BUDGET)")
+
+        if microphone:
+            source = MicrophoneSource()
+        else:
+            await self.aload_audio_file()
+            source = FileSource(self.get_audio_path(), realtime=realtime)
+
+        # Start the engine (and llama-server) before streaming so startup is not counted as latency
+        async with self.get_refinement_engine(threads=engine_threads) as engine:
+            utterances = await refine_live(source, get_live_transcriber(self.transcription_backend), engine,
+                                           (instruction or self.instruction) + LENGTH_SUFFIX, on_result)
+        print_latency_report(utterances)
+        return utterances
+
+    async def get_new_video_urls(self):
+        return (await self.run_pipeline(render="simli"))["hls_url"]
 
 async def main():
+    import rate_limit
+    import resilience
+    from resource_governor import get_governor
+
     pitch = Pitch(video_path="video.mp4")
     await pitch.improve_transcription()
+    get_governor().print_report()
+    resilience.print_report()
+    rate_limit.print_report()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,192 @@
+import os
+import time
+import asyncio
+import sqlite3
+import threading
+
+# Conservative defaults per provider, overridable with PITCH_<PROVIDER>_RPM / _TPM.
+# None means that dimension is not limited.
+PROVIDER_LIMITS = {
+    "openai": {"requests_per_minute": 500, "tokens_per_minute": 200_000},
+    "deepgram": {"requests_per_minute": 100, "tokens_per_minute": None},
+    "simli": {"requests_per_minute": 30, "tokens_per_minute": None},
+    "elevenlabs": {"requests_per_minute": 60, "tokens_per_minute": None},
+}
+
+
+class LocalBucketStore:
+    """
+    Bucket levels kept in this process, shared by every thread and event loop.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def take(self, key, amount, rate, capacity):
+        """
+        Take `amount` from a bucket refilled at `rate` per second up to `capacity`.
+        The level may go negative: the debt is how long the caller has to wait,
+        which queues concurrent callers in arrival order without polling.
+
+        :return: Seconds to wait before the reserved amount may be used
+        """
+        with self.lock:
+            now = time.monotonic()
+            level, updated = self.buckets.get(key, (capacity, now))
+            level = min(capacity, level + (now - updated) * rate) - amount
+            self.buckets[key] = (level, now)
+        return max(0.0, -level / rate)
+
+
+class SQLiteBucketStore:
+    """
+    Bucket levels kept in a local SQLite file, so several processes (batch
+    workers, Streamlit sessions) share one provider budget. The read-modify-write
+    runs in an immediate transaction, which takes the file's write lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS buckets "
+                               "(key TEXT PRIMARY KEY, level REAL NOT NULL, updated REAL NOT NULL)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+
+    def take(self, key, amount, rate, capacity):
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            # Wall clock, since monotonic clocks are not comparable across processes
+            now = time.time()
+            row = connection.execute("SELECT level, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            level, updated = row if row else (capacity, now)
+            level = min(capacity, level + max(0.0, now - updated) * rate) - amount
+            connection.execute("INSERT OR REPLACE INTO buckets (key, level, updated) VALUES (?, ?, ?)",
+                               (key, level, now))
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+        return max(0.0, -level / rate)
+
+
+class RateLimiter:
+    """
+    Client-side token bucket of one provider. Every request takes one unit of
+    the requests/min bucket and, when the provider also limits tokens, its
+    estimated token count from the tokens/min bucket. Callers sleep until both
+    allow the request, so a batch runs at the provider's allowed throughput
+    instead of bursting into 429s.
+    """
+
+    def __init__(self, name, requests_per_minute=None, tokens_per_minute=None, store=None):
+        """
+        :param name: Provider name
+        :param requests_per_minute: Allowed requests per minute, None for no limit
+        :param tokens_per_minute: Allowed tokens per minute, None for no limit
+        :param store: LocalBucketStore or SQLiteBucketStore holding the bucket levels
+        """
+        self.name = name
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.store = store or LocalBucketStore()
+        self.metrics = {"requests": 0, "tokens": 0, "throttled": 0, "wait_seconds": 0.0}
+        self.metrics_lock = threading.Lock()
+
+    def _reserve(self, tokens):
+        """
+        Reserve capacity for one request.
+
+        :return: Seconds to wait before sending it
+        """
+        wait = 0.0
+        # A full minute of burst capacity, refilled continuously
+        if self.requests_per_minute:
+            wait = self.store.take(f"{self.name}:requests", 1, self.requests_per_minute / 60.0,
+                                   self.requests_per_minute)
+        if self.tokens_per_minute and tokens:
+            wait = max(wait, self.store.take(f"{self.name}:tokens", tokens, self.tokens_per_minute / 60.0,
+                                             self.tokens_per_minute))
+        with self.metrics_lock:
+            self.metrics["requests"] += 1
+            self.metrics["tokens"] += tokens
+            if wait > 0:
+                self.metrics["throttled"] += 1
+                self.metrics["wait_seconds"] += wait
+        return wait
+
+    def acquire(self, tokens=0):
+        """
+        Block until one request with `tokens` estimated tokens may be sent.
+        """
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=0):
+        """
+        Same as acquire() without blocking the event loop.
+        """
+        # SQLite may wait on another process's lock, so reserve off the loop
+        if isinstance(self.store, SQLiteBucketStore):
+            wait = await asyncio.to_thread(self._reserve, tokens)
+        else:
+            wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+def _limit_from_env(provider, suffix, default):
+    value = os.getenv(f"PITCH_{provider.upper()}_{suffix}")
+    if value is None:
+        return default
+    # 0 disables the limit
+    return int(value) or None
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+_store = None
+
+
+def get_limiter(provider):
+    """
+    Return the process-wide limiter of a provider. Limits come from
+    PROVIDER_LIMITS, overridden by PITCH_<PROVIDER>_RPM and PITCH_<PROVIDER>_TPM.
+    When PITCH_RATE_LIMIT_DB is set, the buckets live in that SQLite file and are
+    shared with every other process using it.
+
+    :param provider: Provider name, e.g. 'openai', 'deepgram' or 'simli'
+    :return: RateLimiter
+    """
+    global _store
+    with _limiters_lock:
+        if provider not in _limiters:
+            if _store is None:
+                db_path = os.getenv("PITCH_RATE_LIMIT_DB")
+                _store = SQLiteBucketStore(db_path) if db_path else LocalBucketStore()
+            limits = PROVIDER_LIMITS.get(provider, {})
+            _limiters[provider] = RateLimiter(
+                provider,
+                requests_per_minute=_limit_from_env(provider, "RPM", limits.get("requests_per_minute")),
+                tokens_per_minute=_limit_from_env(provider, "TPM", limits.get("tokens_per_minute")),
+                store=_store,
+            )
+        return _limiters[provider]
+
+
+def report():
+    """
+    :return: Dict per provider with its request, token and throttling counters
+    """
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {name: dict(limiter.metrics) for name, limiter in sorted(limiters.items())}
+
+
+def print_report():
+    print(f"{'provider':<10}{'requests':>10}{'tokens':>10}{'throttled':>11}{'waited s':>10}")
+    for name, row in report().items():
+        print(f"{name:<10}{row['requests']:>10}{row['tokens']:>10}{row['throttled']:>11}{row['wait_seconds']:>10.2f}")
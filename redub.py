@@ -0,0 +1,321 @@
+import os
+import re
+import json
+import bisect
+import difflib
+import subprocess
+from pydantic import BaseModel
+
+ELEVENLABS_TTS_URL = "https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
+
+
+class Speech(BaseModel):
+    """
+    Synthesize speech for a piece of refined text with ElevenLabs, using the same
+    voice and settings as the Simli renders.
+    """
+    text: str
+    voice_id: str = "pMsXgVXv3BLzUgSXRplE"
+
+    def synthesize(self, output_path):
+        """
+        :param output_path: Path of the MP3 file to write
+        :return: output_path
+        :raises ServiceError: When ElevenLabs fails for good
+        """
+        import requests
+        from resilience import get_service
+        from rate_limit import get_limiter
+
+        payload = {
+            "text": self.text,
+            "model_id": "eleven_turbo_v2",
+            "voice_settings": {
+                "stability": 0.1,
+                "similarity_boost": 0.3,
+                "style": 0.2
+            }
+        }
+        headers = {
+            "xi-api-key": os.getenv("ELEVENLABS_API_KEY"),
+            "Content-Type": "application/json",
+            "Accept": "audio/mpeg"
+        }
+
+        def post(timeout):
+            response = requests.post(ELEVENLABS_TTS_URL.format(voice_id=self.voice_id),
+                                     json=payload, headers=headers, timeout=timeout)
+            response.raise_for_status()
+            return response.content
+
+        # Every attempt, retries included, first waits for the shared request budget
+        content = get_service("elevenlabs").call(post, before_attempt=get_limiter("elevenlabs").acquire)
+        with open(output_path, "wb") as file:
+            file.write(content)
+        return output_path
+
+
+def _normalize(text):
+    return re.findall(r"[\w']+", text.lower())
+
+
+def align_segments(words, segments):
+    """
+    Locate each refined segment in the original video using the Deepgram word timings.
+
+    The segment 'original' texts are matched against the timed words with difflib,
+    so small differences (cleaned disfluencies, punctuation) do not break alignment.
+
+    :param words: Deepgram word dicts with 'word', 'start' and 'end'
+    :param segments: Segment dicts with 'original' and 'refined' text, in order
+    :return: List of dicts with 'start', 'end', 'refined' and 'changed' for each aligned segment
+    """
+    word_tokens = [" ".join(_normalize(word['word'])) for word in words]
+    segment_tokens, token_segment = [], []
+    for index, segment in enumerate(segments):
+        tokens = _normalize(segment.get('original', ''))
+        segment_tokens.extend(tokens)
+        token_segment.extend([index] * len(tokens))
+
+    # Each timed word is assigned to the segment of the token it matches
+    word_segment = [None] * len(words)
+    matcher = difflib.SequenceMatcher(a=word_tokens, b=segment_tokens, autojunk=False)
+    for block in matcher.get_matching_blocks():
+        for offset in range(block.size):
+            word_segment[block.a + offset] = token_segment[block.b + offset]
+
+    # Unmatched words inside a segment's span belong to it
+    last = None
+    for i, index in enumerate(word_segment):
+        if index is None:
+            word_segment[i] = last
+        else:
+            last = index
+
+    aligned = []
+    for index, segment in enumerate(segments):
+        indices = [i for i, s in enumerate(word_segment) if s == index]
+        if not indices:
+            continue
+        aligned.append({
+            "start": words[indices[0]]['start'],
+            "end": words[indices[-1]]['end'],
+            "refined": segment['refined'],
+            "changed": _normalize(segment.get('original', '')) != _normalize(segment['refined']),
+        })
+    return aligned
+
+
+def probe_video(video_path):
+    """
+    :param video_path: Path to the video
+    :return: Dict with the duration, keyframe times and stream parameters needed to match encodes
+    """
+    command = ["ffprobe", "-v", "error", "-show_entries",
+               "format=duration:stream=codec_type,codec_name,profile,level,width,height,pix_fmt,"
+               "r_frame_rate,sample_rate,channels",
+               "-of", "json", video_path]
+    info = json.loads(subprocess.run(command, capture_output=True, text=True, check=True).stdout)
+    # Only the first video and audio streams are rendered (see Redubber)
+    video = next(s for s in info["streams"] if s["codec_type"] == "video")
+    audio = next((s for s in info["streams"] if s["codec_type"] == "audio"), None)
+
+    command = ["ffprobe", "-v", "error", "-select_streams", "v:0", "-skip_frame", "nokey",
+               "-show_entries", "frame=pts_time", "-of", "csv=p=0", video_path]
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    keyframes = sorted(float(line) for line in output.split() if line.strip())
+
+    return {
+        "duration": float(info["format"]["duration"]),
+        "keyframes": keyframes or [0.0],
+        "video": video,
+        "audio": audio,
+    }
+
+
+# ffmpeg encoders producing the codecs that ffprobe reports
+VIDEO_ENCODERS = {"h264": "libx264", "hevc": "libx265", "vp9": "libvpx-vp9", "av1": "libaom-av1", "mpeg4": "mpeg4"}
+AUDIO_ENCODERS = {"aac": "aac", "mp3": "libmp3lame", "opus": "libopus", "vorbis": "libvorbis",
+                  "ac3": "ac3", "flac": "flac", "pcm_s16le": "pcm_s16le"}
+
+
+def matching_encode_args(info):
+    """
+    Encoder arguments reproducing the source's first video and audio streams
+    (codec, profile, level, pix_fmt, frame rate, sample rate and channels), so
+    re-encoded spans can be joined to stream-copied ones with the concat demuxer.
+
+    :param info: Output of probe_video
+    :return: List of ffmpeg output arguments
+    """
+    video, audio = info["video"], info["audio"]
+    if video["codec_name"] not in VIDEO_ENCODERS or audio["codec_name"] not in AUDIO_ENCODERS:
+        raise ValueError(f"Cannot re-encode {video['codec_name']}/{audio['codec_name']} to match the source; "
+                         f"supported: {list(VIDEO_ENCODERS)} video, {list(AUDIO_ENCODERS)} audio")
+
+    args = ["-c:v", VIDEO_ENCODERS[video["codec_name"]], "-pix_fmt", video["pix_fmt"],
+            "-r", video["r_frame_rate"]]
+    profile = (video.get("profile") or "").lower()
+    if video["codec_name"] == "h264" and profile:
+        profile = {"constrained baseline": "baseline", "high 10": "high10",
+                   "high 4:2:2": "high422", "high 4:4:4 predictive": "high444"}.get(profile, profile)
+        args += ["-profile:v", profile]
+        if video.get("level", 0) > 0:
+            # ffprobe reports h264 level 4.1 as 41
+            args += ["-level:v", f"{video['level'] / 10:.1f}"]
+    elif video["codec_name"] == "hevc" and profile:
+        args += ["-profile:v", profile.replace(" ", "")]
+
+    args += ["-c:a", AUDIO_ENCODERS[audio["codec_name"]], "-ar", str(audio["sample_rate"]),
+             "-ac", str(audio["channels"])]
+    return args
+
+
+def media_duration(path):
+    command = ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path]
+    return float(subprocess.run(command, capture_output=True, text=True, check=True).stdout.strip())
+
+
+def plan_edits(aligned, keyframes, duration):
+    """
+    Split the video timeline into stream-copied spans and re-encoded spans.
+
+    Re-encoded spans are widened to the surrounding keyframes so every copied span
+    starts on a keyframe and can be cut without decoding. Overlapping re-encoded
+    spans are merged.
+
+    :param aligned: Output of align_segments
+    :param keyframes: Sorted keyframe times of the video
+    :param duration: Duration of the video
+    :return: List of ('copy', start, end) and ('encode', start, end, changed segments) tuples
+    """
+    spans = []
+    for segment in (s for s in aligned if s["changed"]):
+        start = keyframes[max(bisect.bisect_right(keyframes, segment["start"]) - 1, 0)]
+        after = bisect.bisect_left(keyframes, segment["end"])
+        end = keyframes[after] if after < len(keyframes) else duration
+        if spans and start <= spans[-1][1]:
+            spans[-1][1] = max(spans[-1][1], end)
+            spans[-1][2].append(segment)
+        else:
+            spans.append([start, end, [segment]])
+
+    plan, position = [], 0.0
+    for start, end, segments in spans:
+        if start > position:
+            plan.append(("copy", position, start))
+        plan.append(("encode", start, end, segments))
+        position = end
+    if position < duration:
+        plan.append(("copy", position, duration))
+    return plan
+
+
+class Redubber(BaseModel):
+    """
+    Re-dub the original video with synthesized speech for the refined segments.
+    Only spans containing changed segments are re-encoded (with their video retimed
+    to the new audio); the rest of the video is stream-copied, so the encode cost
+    scales with the size of the edit rather than the length of the video.
+    """
+    video_path: str
+    work_dir: str = "redub"
+    threads: int = 0
+
+    def _run(self, command, threads=None):
+        """
+        Run one ffmpeg command under a thread budget of the resource governor.
+        The granted thread count is passed to ffmpeg before the output path.
+        """
+        from resource_governor import get_governor
+
+        with get_governor().lease("ffmpeg", threads=threads or self.threads or None,
+                                  name=self.video_path) as lease:
+            command = command[:-1] + ["-threads", str(lease.threads), command[-1]]
+            subprocess.run(command, check=True, capture_output=True)
+
+    def _copy_span(self, start, end, output_path):
+        self._run(["ffmpeg", "-y", "-ss", f"{start:.3f}", "-to", f"{end:.3f}", "-i", self.video_path,
+                   "-map", "0:v:0", "-map", "0:a:0", "-c", "copy", "-avoid_negative_ts", "make_zero",
+                   output_path], threads=1)
+
+    def _encode_span(self, start, end, segments, audio_paths, info, output_path):
+        """
+        Re-encode one span: original footage between changed segments is kept as is,
+        each changed segment's footage is stretched to the length of its new audio.
+        """
+        audio = info["audio"]
+        pieces, position = [], start
+        for segment, audio_path in zip(segments, audio_paths):
+            if segment["start"] > position:
+                pieces.append((position, segment["start"], None))
+            pieces.append((segment["start"], segment["end"], audio_path))
+            position = segment["end"]
+        if end > position:
+            pieces.append((position, end, None))
+
+        inputs = ["-i", self.video_path]
+        audio_format = f"aresample={audio['sample_rate']},aformat=channel_layouts={'stereo' if audio['channels'] == 2 else 'mono'}"
+        filters, labels = [], []
+        for n, (piece_start, piece_end, audio_path) in enumerate(pieces):
+            trim = f"trim={piece_start:.3f}:{piece_end:.3f}"
+            if audio_path is None:
+                filters.append(f"[0:v:0]{trim},setpts=PTS-STARTPTS[v{n}]")
+                filters.append(f"[0:a:0]atrim={piece_start:.3f}:{piece_end:.3f},asetpts=PTS-STARTPTS,{audio_format}[a{n}]")
+            else:
+                inputs += ["-i", audio_path]
+                factor = media_duration(audio_path) / max(piece_end - piece_start, 1e-3)
+                filters.append(f"[0:v:0]{trim},setpts=(PTS-STARTPTS)*{factor:.6f}[v{n}]")
+                filters.append(f"[{len(inputs) // 2 - 1}:a]asetpts=PTS-STARTPTS,{audio_format}[a{n}]")
+            labels.append(f"[v{n}][a{n}]")
+        filters.append(f"{''.join(labels)}concat=n={len(pieces)}:v=1:a=1[v][a]")
+
+        # Match the original streams so the concat demuxer can join without re-encoding
+        self._run(["ffmpeg", "-y", *inputs, "-filter_complex", ";".join(filters),
+                   "-map", "[v]", "-map", "[a]", *matching_encode_args(info), output_path])
+
+    def render(self, words, segments, output_path=None):
+        """
+        Render the re-dubbed video.
+
+        :param words: Deepgram word dicts with timings in the original video
+        :param segments: Refined segment dicts with 'original' and 'refined' text
+        :param output_path: Output video path, defaults to '<video>.redub.mp4'
+        :return: Path of the rendered video
+        """
+        os.makedirs(self.work_dir, exist_ok=True)
+        if output_path is None:
+            output_path = os.path.splitext(self.video_path)[0] + ".redub.mp4"
+
+        info = probe_video(self.video_path)
+        if info["audio"] is None:
+            raise ValueError(f"{self.video_path} has no audio stream to re-dub")
+        # Fail before synthesizing anything if the source streams cannot be matched
+        matching_encode_args(info)
+        plan = plan_edits(align_segments(words, segments), info["keyframes"], info["duration"])
+
+        extension = os.path.splitext(self.video_path)[1]
+        parts, encoded_seconds = [], 0.0
+        for n, step in enumerate(plan):
+            part_path = os.path.abspath(os.path.join(self.work_dir, f"part_{n:03d}{extension}"))
+            if step[0] == "copy":
+                self._copy_span(step[1], step[2], part_path)
+            else:
+                _, start, end, changed = step
+                audio_paths = [
+                    Speech(text=segment["refined"]).synthesize(
+                        os.path.join(self.work_dir, f"tts_{n:03d}_{i}.mp3"))
+                    for i, segment in enumerate(changed)
+                ]
+                self._encode_span(start, end, changed, audio_paths, info, part_path)
+                encoded_seconds += end - start
+            parts.append(part_path)
+
+        concat_list = os.path.join(self.work_dir, "parts.txt")
+        with open(concat_list, "w") as file:
+            file.writelines(f"file '{part}'\n" for part in parts)
+        self._run(["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", concat_list,
+                   "-c", "copy", output_path], threads=1)
+
+        print(f"Re-encoded {encoded_seconds:.1f}s of {info['duration']:.1f}s, stream-copied the rest")
+        return output_path
@@ -1,151 +1,9 @@
-import subprocess
 import json
 import sys
-import httpx
 import asyncio
 import argparse
-
-class LlamaCppServerModifier:
-    def __init__(self, model_path, port=8080, host='127.0.0.1'):
-        """
-        Initialize the Llama.cpp server modifier with async support.
-        
-        :param model_path: Path to the GGUF model file
-        :param port: Port to run the server on
-        :param host: Host address for the server
-        """
-        self.model_path = model_path
-        self.port = port
-        self.host = host
-        self.server_process = None
-        self.client = None
-    
-    async def start_server(self):
-        """
-        Asynchronously start the llama.cpp server.
-        """
-        # Construct the server launch command
-        server_command = [
-            'llama-server',  # Assumes llama-server is in PATH
-            '-m', self.model_path,
-            '--host', str(self.host),
-            '--port', str(self.port)
-        ]
-        
-        # Launch the server as a subprocess
-        self.server_process = subprocess.Popen(
-            server_command, 
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        
-        # Create async HTTP client
-        self.client = httpx.AsyncClient(timeout=30.0)
-        
-        # Wait for server to be ready with exponential backoff
-        max_attempts = 10
-        for attempt in range(max_attempts):
-            try:
-                response = await self._test_server_connection()
-                if response:
-                    print(f"Llama.cpp server started successfully on {self.host}:{self.port}")
-                    return
-                await asyncio.sleep(2 ** attempt)  # Exponential backoff
-            except Exception as e:
-                print(f"Connection attempt {attempt + 1} failed: {e}")
-        
-        raise RuntimeError("Could not connect to the server after multiple attempts")
-    
-    async def _test_server_connection(self):
-        """
-        Async test connection to the server.
-        
-        :return: True if server is responsive, False otherwise
-        """
-        try:
-            response = await self.client.get(f'http://{self.host}:{self.port}/health')
-            return response.status_code == 200
-        except (httpx.RequestError, httpx.HTTPStatusError):
-            return False
-    
-    async def modify_text(self, 
-                    original_text, 
-                    instruction="Rewrite the text to be more concise",
-                    max_tokens=150,
-                    temperature=0.7):
-        """
-        Modify text using the running llama.cpp server asynchronously.
-        
-        :param original_text: Text to be modified
-        :param instruction: Specific instruction for text modification
-        :param max_tokens: Maximum number of tokens to generate
-        :param temperature: Sampling temperature for text generation
-        :return: Modified text
-        """
-        # Construct the full prompt
-        full_prompt = f"{instruction}\n\nOriginal Text: {original_text}\n\nModified Text:"
-        
-        # Prepare request payload
-        payload = {
-            "prompt": full_prompt,
-            "n_predict": max_tokens,
-            "temperature": temperature,
-            "stop": ["\n"]
-        }
-        
-        try:
-            # Send async request to the server
-            response = await self.client.post(
-                f'http://{self.host}:{self.port}/completion', 
-                json=payload
-            )
-
-            # Check if request was successful
-            if response.status_code == 200:
-                # Extract the generated text
-                result = response.json()
-                modified_text = result.get('content', '').strip()
-                return modified_text
-            else:
-                print(f"Server error: {response.status_code}")
-                return None
-        
-        except (httpx.RequestError, httpx.HTTPStatusError) as e:
-            print(f"Request error: {e}")
-            return None
-    
-    async def _stop_server(self):
-        """
-        Async method to stop the llama.cpp server.
-        """
-        if self.client:
-            await self.client.aclose()
-        
-        if self.server_process:
-            print("Stopping llama.cpp server...")
-            self.server_process.terminate()
-            try:
-                # Wait for the process to end
-                self.server_process.wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                # Force kill if it doesn't terminate
-                self.server_process.kill()
-            
-            print("Server stopped.")
-    
-    async def __aenter__(self):
-        """
-        Async context manager entry - start the server.
-        """
-        await self.start_server()
-        return self
-    
-    async def __aexit__(self, exc_type, exc_val, exc_tb):
-        """
-        Async context manager exit - stop the server.
-        """
-        await self._stop_server()
+from refinePitchText2 import LlamaCppServerModifier
+from refinement_engine import INSTRUCTIONS, LENGTH_SUFFIX
 
 def extract_transcript_from_json(json_path):
     """
@@ -185,11 +43,7 @@ async def refinePitch():
         print(transcript)
     
     # Modification instructions
-    instructions = [
-        "Make this pitch more engaging, concise, and impactful",
-        "Use confident and persuasive language that clearly communicates the value proposition, connects with the audience emotionally, and inspires them to take action",
-        "Simplify any jargon, emphasize key benefits, and include a strong call-to-action"
-    ]
+    instructions = INSTRUCTIONS
     
     # Use async context manager to handle server lifecycle
     try:
@@ -212,7 +66,7 @@ async def refinePitch():
                         instruction = instructions[choice - 1]
                         modified_text = await modifier.modify_text(
                             transcript, 
-                            instruction=instruction+". keep the speech length same."
+                            instruction=instruction+LENGTH_SUFFIX
                         )
                         
                         # Display result
@@ -227,7 +81,7 @@ async def refinePitch():
                         instruction = input("Enter your own prompt: ")
                         modified_text = await modifier.modify_text(
                             transcript, 
-                            instruction=instruction+". keep the speech length same."
+                            instruction=instruction+LENGTH_SUFFIX
                         )
                         
                         # Display result
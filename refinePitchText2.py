@@ -1,73 +1,42 @@
-import subprocess
-import json
 import sys
-import httpx
-import asyncio
-import argparse
+from refinement_engine import (
+    INSTRUCTIONS,
+    LENGTH_SUFFIX,
+    LlamaServerBackend,
+    RefinementEngine,
+    extract_transcript_from_json,
+)
+from resilience import ServiceError
 
-class LlamaCppServerModifier:
-    def __init__(self, model_path, port=8080, host='127.0.0.1'):
+class LlamaCppServerModifier(RefinementEngine):
+    def __init__(self, model_path, port=8080, host='127.0.0.1',
+                 draft_model_path=None, draft_max=16, draft_min=0, draft_p_min=0.75,
+                 extra_server_args=None, cache_size=128):
         """
         Initialize the Llama.cpp server modifier with async support.
         
         :param model_path: Path to the GGUF model file
         :param port: Port to run the server on
         :param host: Host address for the server
+        :param draft_model_path: Optional small GGUF model used for speculative decoding
+        :param draft_max: Maximum number of draft tokens proposed per step
+        :param draft_min: Minimum number of draft tokens proposed per step
+        :param draft_p_min: Minimum draft probability for a token to be proposed
+        :param extra_server_args: Additional raw arguments passed to llama-server
+        :param cache_size: Number of refinements kept in the LRU cache, 0 to disable
         """
-        self.model_path = model_path
-        self.port = port
-        self.host = host
-        self.server_process = None
-        self.client = None
+        super().__init__(LlamaServerBackend(
+            model_path, port=port, host=host,
+            draft_model_path=draft_model_path, draft_max=draft_max,
+            draft_min=draft_min, draft_p_min=draft_p_min,
+            extra_server_args=extra_server_args
+        ), cache_size=cache_size)
     
     async def start_server(self):
         """
         Asynchronously start the llama.cpp server.
         """
-        # Construct the server launch command
-        server_command = [
-            'llama-server',  # Assumes llama-server is in PATH
-            '-m', self.model_path,
-            '--host', str(self.host),
-            '--port', str(self.port)
-        ]
-        
-        # Launch the server as a subprocess
-        self.server_process = subprocess.Popen(
-            server_command, 
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        
-        # Create async HTTP client
-        self.client = httpx.AsyncClient(timeout=30.0)
-        
-        # Wait for server to be ready with exponential backoff
-        max_attempts = 10
-        for attempt in range(max_attempts):
-            try:
-                response = await self._test_server_connection()
-                if response:
-                    print(f"Llama.cpp server started successfully on {self.host}:{self.port}")
-                    return
-                await asyncio.sleep(2 ** attempt)  # Exponential backoff
-            except Exception as e:
-                print(f"Connection attempt {attempt + 1} failed: {e}")
-        
-        raise RuntimeError("Could not connect to the server after multiple attempts")
-    
-    async def _test_server_connection(self):
-        """
-        Async test connection to the server.
-        
-        :return: True if server is responsive, False otherwise
-        """
-        try:
-            response = await self.client.get(f'http://{self.host}:{self.port}/health')
-            return response.status_code == 200
-        except (httpx.RequestError, httpx.HTTPStatusError):
-            return False
+        await self.start()
     
     async def modify_text(self, 
                     original_text, 
@@ -81,92 +50,20 @@ class LlamaCppServerModifier:
         :param instruction: Specific instruction for text modification
         :param max_tokens: Maximum number of tokens to generate
         :param temperature: Sampling temperature for text generation
-        :return: Modified text
+        :return: Modified text, or None if the backend failed
         """
-        # Construct the full prompt
-        full_prompt = f"{instruction}\n\nOriginal Text: {original_text}\n\nModified Text:"
-        
-        # Prepare request payload
-        payload = {
-            "prompt": full_prompt,
-            "n_predict": max_tokens,
-            "temperature": temperature,
-            "stop": ["\n"]
-        }
-        
         try:
-            # Send async request to the server
-            response = await self.client.post(
-                f'http://{self.host}:{self.port}/completion', 
-                json=payload
-            )
-
-            # Check if request was successful
-            if response.status_code == 200:
-                # Extract the generated text
-                result = response.json()
-                modified_text = result.get('content', '').strip()
-                return modified_text
-            else:
-                print(f"Server error: {response.status_code}")
-                return None
-        
-        except (httpx.RequestError, httpx.HTTPStatusError) as e:
-            print(f"Request error: {e}")
+            return await self.refine(original_text, instruction, max_tokens, temperature)
+        except ServiceError:
             return None
     
     async def _stop_server(self):
         """
         Async method to stop the llama.cpp server.
         """
-        if self.client:
-            await self.client.aclose()
-        
-        if self.server_process:
-            print("Stopping llama.cpp server...")
-            self.server_process.terminate()
-            try:
-                # Wait for the process to end
-                self.server_process.wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                # Force kill if it doesn't terminate
-                self.server_process.kill()
-            
-            print("Server stopped.")
-    
-    async def __aenter__(self):
-        """
-        Async context manager entry - start the server.
-        """
-        await self.start_server()
-        return self
-    
-    async def __aexit__(self, exc_type, exc_val, exc_tb):
-        """
-        Async context manager exit - stop the server.
-        """
-        await self._stop_server()
+        await self.stop()
 
-def extract_transcript_from_json(data):
-    """
-    Extract transcript from a JSON file containing speech transcription results.
-    
-    :param json_path: Path to the JSON file
-    :return: Extracted transcript text
-    """
-    try:
-        # with open(json_path, 'r') as file:
-        #     data = json.load(file)
-        
-        # Navigate to the transcript in the nested structure
-        transcript = data['results']['channels'][0]['alternatives'][0]['transcript']
-        return transcript
-    
-    except (KeyError, FileNotFoundError, json.JSONDecodeError) as e:
-        print(f"Error extracting transcript: {e}")
-        return None
-
-async def refinePitch(json_path, model_path, port, prompt=None):
+async def refinePitch(json_path, model_path, port, prompt=None, structured=False, clean=False):
     # Set up argument parsing
     # parser = argparse.ArgumentParser(description="Llama.cpp Server Text Modifier")
     # parser.add_argument('json_path', help='Path to the input JSON file')
@@ -177,7 +74,7 @@ async def refinePitch(json_path, model_path, port, prompt=None):
     #args = parser.parse_args()
     
     # Extract transcript
-    transcript = extract_transcript_from_json(json_path)
+    transcript = extract_transcript_from_json(json_path, clean=clean)
     if not transcript:
         print("No transcript found in the JSON file.")
         sys.exit(1)
@@ -186,27 +83,34 @@ async def refinePitch(json_path, model_path, port, prompt=None):
         print(transcript)
     
     # Modification instructions
-    instructions = [
-        "Make this pitch more engaging, concise, and impactful",
-        "Use confident and persuasive language that clearly communicates the value proposition, connects with the audience emotionally, and inspires them to take action",
-        "Simplify any jargon, emphasize key benefits, and include a strong call-to-action"
-    ]
+    instructions = INSTRUCTIONS
     print("\n--- Starting the server ---")
     # Use async context manager to handle server lifecycle
     try:
         async with LlamaCppServerModifier(model_path=model_path, port=port) as modifier:
             # Interactive modification loop
+            if prompt is not None and structured:
+                # Refined text, per-segment text and strategy in one constrained call
+                refinement = await modifier.refine_structured(
+                    transcript,
+                    instruction=prompt+LENGTH_SUFFIX
+                )
+                print("\n--- Modified Text ---")
+                if refinement is None:
+                    # Never hand the original text on as if it were refined
+                    raise RuntimeError("Structured refinement failed")
+                return refinement
             if prompt is not None:
                 instruction = prompt
                 modified_text = await modifier.modify_text(
                     transcript, 
-                    instruction=instruction+". keep the speech length same."
+                    instruction=instruction+LENGTH_SUFFIX
                 )
                 
                 # Display result
                 print("\n--- Modified Text ---")
                 if modified_text is None:
-                    return transcript
+                    raise RuntimeError("Refinement failed")
                 return modified_text
             while True:
                 print("\n--- Available Instructions ---")
@@ -225,7 +129,7 @@ async def refinePitch(json_path, model_path, port, prompt=None):
                         instruction = instructions[choice - 1]
                         modified_text = await modifier.modify_text(
                             transcript, 
-                            instruction=instruction+". keep the speech length same."
+                            instruction=instruction+LENGTH_SUFFIX
                         )
                         
                         # Display result
@@ -235,7 +139,7 @@ async def refinePitch(json_path, model_path, port, prompt=None):
                         instruction = input("Enter your own prompt: ")
                         modified_text = await modifier.modify_text(
                             transcript, 
-                            instruction=instruction+". keep the speech length same."
+                            instruction=instruction+LENGTH_SUFFIX
                         )
                         
                         # Display result
@@ -248,6 +152,7 @@ async def refinePitch(json_path, model_path, port, prompt=None):
     
     except Exception as e:
         print(f"An error occurred: {e}")
+        raise
 
 # if __name__ == "__main__":
 #     asyncio.run(refinePitch())
\ No newline at end of file
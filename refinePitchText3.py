@@ -1,99 +1,47 @@
-import subprocess
 import json
 import sys
-import httpx
 import asyncio
 import argparse
-import os
+from refinement_engine import INSTRUCTIONS, LENGTH_SUFFIX, RefinementEngine, create_backend
+from resilience import ServiceError
 
-class ModelAPIModifier:
-    def __init__(self, model_type='llama', model_path=None, api_key=None, port=8080, host='127.0.0.1'):
+class ModelAPIModifier(RefinementEngine):
+    def __init__(self, model_type='llama', model_path=None, api_key=None, port=8080, host='127.0.0.1',
+                 draft_model_path=None, draft_max=16, draft_min=0, draft_p_min=0.75,
+                 extra_server_args=None):
         """
         Initialize the model modifier with support for Llama.cpp and OpenAI
         
-        :param model_type: 'llama' or 'openai'
+        :param model_type: 'llama', 'openai' or 'llama-cpp-python'
         :param model_path: Path to the GGUF model (for Llama)
         :param api_key: OpenAI API key
         :param port: Port to run the server on (for Llama)
         :param host: Host address for the server (for Llama)
+        :param draft_model_path: Optional draft GGUF model for speculative decoding (for Llama)
+        :param draft_max: Maximum number of draft tokens proposed per step (for Llama)
+        :param draft_min: Minimum number of draft tokens proposed per step (for Llama)
+        :param draft_p_min: Minimum draft probability for a token to be proposed (for Llama)
+        :param extra_server_args: Additional raw arguments passed to llama-server (for Llama)
         """
-        self.model_type = model_type
-        self.model_path = model_path
-        self.port = port
-        self.host = host
-        self.server_process = None
-        self.client = None
-        
-        # OpenAI specific setup
         if model_type == 'openai':
-            if not api_key:
-                api_key = os.getenv('OPENAI_API_KEY')
-            if not api_key:
-                raise ValueError("OpenAI API key is required. Set OPENAI_API_KEY environment variable.")
-            self.api_key = api_key
-            self.client = httpx.AsyncClient(
-                headers={
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json"
-                },
-                timeout=30.0
+            backend = create_backend('openai', api_key=api_key)
+        elif model_type == 'llama-cpp-python':
+            backend = create_backend('llama-cpp-python', model_path=model_path)
+        else:
+            backend = create_backend(
+                'llama', model_path=model_path, port=port, host=host,
+                draft_model_path=draft_model_path, draft_max=draft_max,
+                draft_min=draft_min, draft_p_min=draft_p_min,
+                extra_server_args=extra_server_args
             )
+        super().__init__(backend)
+        self.model_type = model_type
     
     async def start_server(self):
         """
         Start the server (Llama.cpp) or prepare API client (OpenAI)
         """
-        if self.model_type == 'llama':
-            # Construct the server launch command
-            server_command = [
-                'llama-server',  # Assumes llama-server is in PATH
-                '-m', self.model_path,
-                '--host', str(self.host),
-                '--port', str(self.port)
-            ]
-            
-            # Launch the server as a subprocess
-            self.server_process = subprocess.Popen(
-                server_command, 
-                stdout=subprocess.PIPE, 
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            
-            # Create async HTTP client for Llama
-            self.client = httpx.AsyncClient(timeout=30.0)
-            
-            # Wait for server to be ready with exponential backoff
-            max_attempts = 10
-            for attempt in range(max_attempts):
-                try:
-                    response = await self._test_server_connection()
-                    if response:
-                        print(f"Llama.cpp server started successfully on {self.host}:{self.port}")
-                        return
-                    await asyncio.sleep(2 ** attempt)  # Exponential backoff
-                except Exception as e:
-                    print(f"Connection attempt {attempt + 1} failed: {e}")
-            
-            raise RuntimeError("Could not connect to the server after multiple attempts")
-        
-        # For OpenAI, just confirm API key is set
-        elif self.model_type == 'openai':
-            print("OpenAI API client initialized.")
-    
-    async def _test_server_connection(self):
-        """
-        Test connection to the Llama.cpp server
-        
-        :return: True if server is responsive, False otherwise
-        """
-        if self.model_type == 'llama':
-            try:
-                response = await self.client.get(f'http://{self.host}:{self.port}/health')
-                return response.status_code == 200
-            except (httpx.RequestError, httpx.HTTPStatusError):
-                return False
-        return True
+        await self.start()
     
     async def modify_text(self, 
                     original_text, 
@@ -107,112 +55,18 @@ class ModelAPIModifier:
         :param instruction: Specific instruction for text modification
         :param max_tokens: Maximum number of tokens to generate
         :param temperature: Sampling temperature for text generation
-        :return: Modified text
+        :return: Modified text, or None if the backend failed
         """
-        if self.model_type == 'llama':
-            # Construct the full prompt for Llama
-            full_prompt = f"{instruction}\n\nOriginal Text: {original_text}\n\nModified Text:"
-            
-            # Prepare request payload
-            payload = {
-                "prompt": full_prompt,
-                "n_predict": max_tokens,
-                "temperature": temperature,
-                "stop": ["\n"]
-            }
-            
-            try:
-                # Send async request to the server
-                response = await self.client.post(
-                    f'http://{self.host}:{self.port}/completion', 
-                    json=payload
-                )
-
-                # Check if request was successful
-                if response.status_code == 200:
-                    # Extract the generated text
-                    result = response.json()
-                    modified_text = result.get('content', '').strip()
-                    return modified_text
-                else:
-                    print(f"Server error: {response.status_code}")
-                    return None
-            
-            except (httpx.RequestError, httpx.HTTPStatusError) as e:
-                print(f"Request error: {e}")
-                return None
-        
-        elif self.model_type == 'openai':
-            # Construct the full prompt for OpenAI
-            full_prompt = f"{instruction}\n\nOriginal Text: {original_text}\n\nModified Text:"
-            
-            # Prepare OpenAI API payload
-            payload = {
-                "model": "gpt-3.5-turbo",
-                "messages": [
-                    {"role": "system", "content": "You are a helpful assistant that modifies text."},
-                    {"role": "user", "content": full_prompt}
-                ],
-                "max_tokens": max_tokens,
-                "temperature": temperature
-            }
-            
-            try:
-                # Send async request to OpenAI
-                response = await self.client.post(
-                    "https://api.openai.com/v1/chat/completions", 
-                    json=payload
-                )
-
-                # Check if request was successful
-                if response.status_code == 200:
-                    # Extract the generated text
-                    result = response.json()
-                    modified_text = result['choices'][0]['message']['content'].strip()
-                    return modified_text
-                else:
-                    print(f"OpenAI API error: {response.status_code}")
-                    return None
-            
-            except (httpx.RequestError, httpx.HTTPStatusError) as e:
-                print(f"OpenAI request error: {e}")
-                return None
+        try:
+            return await self.refine(original_text, instruction, max_tokens, temperature)
+        except ServiceError:
+            return None
     
     async def _stop_server(self):
         """
         Stop the server or close the client
         """
-        if self.model_type == 'llama':
-            if self.client:
-                await self.client.aclose()
-            
-            if self.server_process:
-                print("Stopping llama.cpp server...")
-                self.server_process.terminate()
-                try:
-                    # Wait for the process to end
-                    self.server_process.wait(timeout=5)
-                except subprocess.TimeoutExpired:
-                    # Force kill if it doesn't terminate
-                    self.server_process.kill()
-                
-                print("Server stopped.")
-        elif self.model_type == 'openai':
-            if self.client:
-                await self.client.aclose()
-    
-    async def __aenter__(self):
-        """
-        Async context manager entry - start the server or prepare API client
-        """
-        await self.start_server()
-        return self
-    
-    async def __aexit__(self, exc_type, exc_val, exc_tb):
-        """
-        Async context manager exit - stop the server or close the client
-        """
-        await self._stop_server()
+        await self.stop()
 
 def extract_transcript_from_json(json_path):
     """
@@ -233,7 +87,52 @@ def extract_transcript_from_json(json_path):
         print(f"Error extracting transcript: {e}")
         return None
 
-# [Rest of the previous script remains the same]
+class PitchContextGatherer:
+    """
+    Ask the speaker a few questions about the pitch context from the terminal.
+    """
+    questions = [
+        ("audience", "Who is the audience of this pitch?"),
+        ("goal", "What do you want the audience to do after the pitch?"),
+        ("setting", "Where will the pitch be delivered (e.g. investor meeting, demo day, video)?"),
+        ("tone", "What tone do you want (e.g. formal, friendly, bold)?"),
+        ("highlights", "Which points must be kept or emphasized?"),
+    ]
+    
+    async def gather_context(self):
+        """
+        Ask the context questions without blocking the event loop
+        
+        :return: Dict mapping question key to the answer
+        """
+        print("I'll ask you five questions about your context and requirements. Based on that I'll refine your pitch")
+        context = {}
+        for key, question in self.questions:
+            context[key] = (await asyncio.to_thread(input, f"{question} ")).strip()
+        return context
+
+async def generate_refinement_strategy(modifier, transcript, context):
+    """
+    Refine the transcript for the gathered context in a single structured request.
+    The model returns the refined text, the per-segment text and the strategy it
+    applied together, so no follow-up request is needed.
+    
+    :param modifier: Started ModelAPIModifier
+    :param transcript: Original transcript text
+    :param context: Context dict from PitchContextGatherer
+    :return: Structured refinement dict, or None on failure
+    """
+    context_lines = "\n".join(f"- {key}: {value}" for key, value in context.items() if value)
+    instruction = (
+        "Refine this pitch for the following context, choosing the tone and focus that fit it best:\n"
+        f"{context_lines}\n"
+        "Keep the speech length same."
+    )
+    try:
+        return await modifier.refine_structured(transcript, instruction=instruction)
+    except ServiceError:
+        return None
+
 async def main():
     # Set up argument parsing
     parser = argparse.ArgumentParser(description="Multi-Model Text Modifier")
@@ -250,6 +149,8 @@ async def main():
     parser.add_argument('--model-path', help='Path to the GGUF model (for Llama)')
     parser.add_argument('--api-key', help='OpenAI API key (optional, can use OPENAI_API_KEY env)')
     parser.add_argument('--port', type=int, default=8080, help='Port for the server (default: 8080)')
+    parser.add_argument('--draft-model-path', help='Draft GGUF model for speculative decoding (for Llama)')
+    parser.add_argument('--draft-max', type=int, default=16, help='Max draft tokens per step (default: 16)')
     
     # Parse arguments
     args = parser.parse_args()
@@ -264,18 +165,16 @@ async def main():
         print(transcript)
     
     # Modification instructions
-    instructions = [
-        "Make this pitch more engaging, concise, and impactful",
-        "Use confident and persuasive language that clearly communicates the value proposition, connects with the audience emotionally, and inspires them to take action",
-        "Simplify any jargon, emphasize key benefits, and include a strong call-to-action"
-    ]
+    instructions = INSTRUCTIONS
     
     # Prepare model modifier arguments
     modifier_args = {
         'model_type': args.model_type,
         'model_path': args.model_path if args.model_type == 'llama' else None,
         'api_key': args.api_key if args.model_type == 'openai' else None,
-        'port': args.port
+        'port': args.port,
+        'draft_model_path': args.draft_model_path if args.model_type == 'llama' else None,
+        'draft_max': args.draft_max
     }
     
     # Use async context manager to handle server lifecycle
@@ -300,28 +199,25 @@ async def main():
                         context_gatherer = PitchContextGatherer()
                         context = await context_gatherer.gather_context()
                         
-                        # Generate refinement strategy dynamically
-                        comprehensive_instruction = await generate_refinement_strategy(modifier, context)
-                        
-                        # Modify text with the AI-generated instruction
-                        modified_text = await modifier.modify_text(
-                            transcript, 
-                            instruction=comprehensive_instruction+". keep the speech length same."
-                        )
+                        # Generate the strategy and the refined pitch in one structured call
+                        refinement = await generate_refinement_strategy(modifier, transcript, context)
+                        if refinement is None:
+                            print("Could not refine the pitch for this context.")
+                            continue
                         
                         # Display result
                         print("\n--- Context-Refined Pitch ---")
                         print("\n--- Refinement Strategy ---")
-                        print(comprehensive_instruction)
+                        print(json.dumps(refinement['strategy'], indent=2))
                         print("\n--- Modified Pitch ---")
-                        print(modified_text)
+                        print(refinement['refined_text'])
                     
                     elif 1 <= choice <= len(instructions):
                         # Modify text with selected instruction
                         instruction = instructions[choice - 1]
                         modified_text = await modifier.modify_text(
                             transcript, 
-                            instruction=instruction+". keep the speech length same."
+                            instruction=instruction+LENGTH_SUFFIX
                         )
                         
                         # Display result
@@ -331,7 +227,7 @@ async def main():
                         instruction = input("Enter your own prompt: ")
                         modified_text = await modifier.modify_text(
                             transcript, 
-                            instruction=instruction+". keep the speech length same."
+                            instruction=instruction+LENGTH_SUFFIX
                         )
                         
                         # Display result
@@ -0,0 +1,624 @@
+import os
+import json
+import time
+import asyncio
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+from typing import Protocol
+
+from structured_output import (
+    REFINEMENT_GBNF,
+    build_structured_prompt,
+    openai_response_format,
+    parse_structured_refinement,
+)
+
+# Built-in refinement styles offered by the CLIs
+INSTRUCTIONS = [
+    "Make this pitch more engaging, concise, and impactful",
+    "Use confident and persuasive language that clearly communicates the value proposition, connects with the audience emotionally, and inspires them to take action",
+    "Simplify any jargon, emphasize key benefits, and include a strong call-to-action"
+]
+
+# Appended to every instruction so the refined speech fits the original video
+LENGTH_SUFFIX = ". keep the speech length same."
+
+
+def build_prompt(original_text, instruction):
+    """
+    :param original_text: Text to be modified
+    :param instruction: Specific instruction for text modification
+    :return: Completion prompt
+    """
+    return f"{instruction}\n\nOriginal Text: {original_text}\n\nModified Text:"
+
+
+def speculative_server_args(draft_model_path, draft_max=16, draft_min=0, draft_p_min=0.75):
+    """
+    Build the llama-server arguments enabling speculative decoding with a draft model.
+
+    Refined pitches closely paraphrase the transcript, so a small draft model of the
+    same family gets most of its proposals accepted by the main model.
+
+    :param draft_model_path: Path to the draft GGUF model, or None to disable
+    :param draft_max: Maximum number of draft tokens proposed per step
+    :param draft_min: Minimum number of draft tokens proposed per step
+    :param draft_p_min: Minimum draft probability for a token to be proposed
+    :return: List of command line arguments (empty when disabled)
+    """
+    if not draft_model_path:
+        return []
+    return [
+        '-md', draft_model_path,
+        '--draft-max', str(draft_max),
+        '--draft-min', str(draft_min),
+        '--draft-p-min', str(draft_p_min)
+    ]
+
+
+def extract_transcript_from_json(data, clean=False):
+    """
+    Extract transcript from a Deepgram response.
+
+    :param data: Deepgram-shaped response dict
+    :param clean: Remove repetitions, fillers and stutters using the timed words
+    :return: Extracted transcript text
+    """
+    try:
+        if clean:
+            from transcript_cleaning import clean_transcript
+
+            # Shorter prompts mean less llama prefill time and lower OpenAI cost
+            transcript, report = clean_transcript(data)
+            print(f"Pre-cleaning removed {report['duplicates']} repetitions, {report['fillers']} fillers "
+                  f"and {report['stutters']} stutters, saving ~{report['saved_tokens']} of "
+                  f"{report['original_tokens']} prompt tokens")
+            return transcript
+
+        # Navigate to the transcript in the nested structure
+        transcript = data['results']['channels'][0]['alternatives'][0]['transcript']
+        return transcript
+
+    except (KeyError, FileNotFoundError, json.JSONDecodeError) as e:
+        print(f"Error extracting transcript: {e}")
+        return None
+
+
+class RefinementBackend(Protocol):
+    """
+    A text generation backend of the refinement engine. Backends only know how to
+    turn a prompt into text; the engine owns the HTTP client, caching, metrics and
+    concurrency, so those are implemented once for every backend.
+    """
+    name: str
+
+    async def start(self, client):
+        """
+        Start the backend (launch a server, load a model, ...).
+
+        :param client: Shared httpx.AsyncClient of the engine
+        """
+
+    async def complete(self, client, original_text, instruction, max_tokens, temperature, structured=False,
+                       timeout=None):
+        """
+        :param timeout: Seconds left for this attempt, None for no attempt timeout
+        :return: (generated text, timings dict or None); raises on failure
+        """
+
+    async def stop(self):
+        """
+        Release the resources acquired in start().
+        """
+
+
+class LlamaServerBackend:
+    """
+    llama.cpp `llama-server` launched as a subprocess and queried over HTTP.
+    """
+    name = "llama"
+
+    def __init__(self, model_path, port=8080, host='127.0.0.1',
+                 draft_model_path=None, draft_max=16, draft_min=0, draft_p_min=0.75,
+                 extra_server_args=None, threads=None, launch=True, startup_timeout=300.0):
+        """
+        :param model_path: Path to the GGUF model file
+        :param port: Port to run the server on
+        :param host: Host address for the server
+        :param draft_model_path: Optional small GGUF model used for speculative decoding
+        :param draft_max: Maximum number of draft tokens proposed per step
+        :param draft_min: Minimum number of draft tokens proposed per step
+        :param draft_p_min: Minimum draft probability for a token to be proposed
+        :param extra_server_args: Additional raw arguments passed to llama-server
+        :param threads: Threads requested from the resource governor, None for its default
+        :param launch: Launch llama-server; False connects to one already running at host:port
+        :param startup_timeout: Seconds to wait for the model (and draft model) to load
+        """
+        self.model_path = model_path
+        self.port = port
+        self.host = host
+        self.draft_model_path = draft_model_path
+        self.draft_max = draft_max
+        self.draft_min = draft_min
+        self.draft_p_min = draft_p_min
+        self.extra_server_args = list(extra_server_args or [])
+        self.threads = threads
+        self.launch = launch
+        self.startup_timeout = startup_timeout
+        self.server_process = None
+        self.lease = None
+
+    @property
+    def base_url(self):
+        return f'http://{self.host}:{self.port}'
+
+    def server_command(self, threads):
+        return [
+            'llama-server',  # Assumes llama-server is in PATH
+            '-m', self.model_path,
+            '--host', str(self.host),
+            '--port', str(self.port),
+            '--threads', str(threads)
+        ] + speculative_server_args(self.draft_model_path, self.draft_max,
+                                    self.draft_min, self.draft_p_min) + self.extra_server_args
+
+    async def _test_server_connection(self, client):
+        import httpx
+
+        try:
+            response = await client.get(f'{self.base_url}/health')
+            return response.status_code == 200
+        except (httpx.RequestError, httpx.HTTPStatusError):
+            return False
+
+    async def start(self, client):
+        from resource_governor import get_governor
+
+        if not self.launch:
+            # A shared or remote server manages its own threads
+            if not await self._test_server_connection(client):
+                raise RuntimeError(f"No llama server is running at {self.base_url}")
+            return
+
+        # The server keeps its thread budget for its whole lifetime; without it every
+        # instance would default to all cores and compete with ffmpeg and each other
+        self.lease = await get_governor().acquire_async("llama", threads=self.threads, name=self.model_path)
+        try:
+            await self._launch(client)
+        except BaseException:
+            # Do not leave the process running or its thread budget held
+            await self.stop()
+            raise
+
+    async def _launch(self, client):
+        # Launch the server as a subprocess
+        self.server_process = subprocess.Popen(
+            self.server_command(self.lease.threads),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            text=True
+        )
+
+        # Poll until the model is loaded; large models with a draft model take minutes
+        deadline = time.monotonic() + self.startup_timeout
+        delay = 0.25
+        while time.monotonic() < deadline:
+            if await self._test_server_connection(client):
+                print(f"Llama.cpp server started successfully on {self.host}:{self.port}")
+                return
+            if self.server_process.poll() is not None:
+                returncode = self.server_process.returncode
+                self.server_process = None
+                raise RuntimeError(f"llama-server exited with code {returncode} before it was ready")
+            await asyncio.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+            delay = min(delay * 2, 2.0)
+        raise RuntimeError(f"llama-server was not ready after {self.startup_timeout:.0f}s")
+
+    async def complete(self, client, original_text, instruction, max_tokens, temperature, structured=False,
+                       timeout=None):
+        payload = {"n_predict": max_tokens, "temperature": temperature}
+        if structured:
+            payload.update(prompt=build_structured_prompt(original_text, instruction), grammar=REFINEMENT_GBNF)
+        else:
+            payload.update(prompt=build_prompt(original_text, instruction), stop=["\n"])
+
+        response = await client.post(f'{self.base_url}/completion', json=payload, timeout=timeout or client.timeout)
+        response.raise_for_status()
+        result = response.json()
+        return result.get('content', ''), result.get('timings')
+
+    async def stop(self):
+        # Hand the threads back first so queued jobs are not held up by the shutdown wait
+        if self.lease:
+            self.lease.release()
+            self.lease = None
+        if self.server_process:
+            print("Stopping llama.cpp server...")
+            self.server_process.terminate()
+            try:
+                # Wait for the process to end
+                await asyncio.to_thread(self.server_process.wait, timeout=5)
+            except subprocess.TimeoutExpired:
+                # Force kill if it doesn't terminate
+                self.server_process.kill()
+            self.server_process = None
+            print("Server stopped.")
+
+
+OPENAI_SYSTEM_PROMPT = "You are a helpful assistant that modifies text."
+
+
+class OpenAIBackend:
+    """
+    OpenAI chat completions, or any server exposing the same API.
+    """
+    name = "openai"
+
+    def __init__(self, api_key=None, model="gpt-3.5-turbo", structured_model="gpt-4o-mini",
+                 base_url="https://api.openai.com/v1"):
+        """
+        :param api_key: API key, defaults to the OPENAI_API_KEY environment variable
+        :param model: Model used for plain refinements
+        :param structured_model: Model used for structured refinements (`json_schema` support required)
+        :param base_url: Base URL of the OpenAI-compatible API
+        """
+        self.api_key = api_key or os.getenv('OPENAI_API_KEY')
+        if not self.api_key:
+            raise ValueError("OpenAI API key is required. Set OPENAI_API_KEY environment variable.")
+        self.model = model
+        self.structured_model = structured_model
+        self.base_url = base_url.rstrip('/')
+
+    async def start(self, client):
+        print("OpenAI API client initialized.")
+
+    async def complete(self, client, original_text, instruction, max_tokens, temperature, structured=False,
+                       timeout=None):
+        prompt = (build_structured_prompt if structured else build_prompt)(original_text, instruction)
+        payload = {
+            "model": self.structured_model if structured else self.model,
+            "messages": [
+                {"role": "system", "content": OPENAI_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            "max_tokens": max_tokens,
+            "temperature": temperature
+        }
+        if structured:
+            payload["response_format"] = openai_response_format()
+
+        response = await client.post(f"{self.base_url}/chat/completions", json=payload,
+                                     headers={"Authorization": f"Bearer {self.api_key}"},
+                                     timeout=timeout or client.timeout)
+        response.raise_for_status()
+        result = response.json()
+        return result['choices'][0]['message']['content'], result.get('usage')
+
+    async def throttle(self, original_text, instruction, max_tokens, structured=False):
+        """
+        Wait for the process-wide OpenAI requests/min and tokens/min budget.
+        OpenAI counts the prompt plus max_tokens against the tokens/min limit.
+        """
+        from rate_limit import get_limiter
+        from transcript_cleaning import estimate_tokens
+
+        prompt = (build_structured_prompt if structured else build_prompt)(original_text, instruction)
+        await get_limiter("openai").acquire_async(
+            tokens=estimate_tokens(OPENAI_SYSTEM_PROMPT + " " + prompt) + max_tokens)
+
+    async def stop(self):
+        pass
+
+
+class LlamaCppPythonBackend:
+    """
+    In-process llama-cpp-python model: no server launch and no HTTP round trip.
+    """
+    name = "llama-cpp-python"
+
+    def __init__(self, model_path, n_ctx=4096, n_threads=None):
+        """
+        :param model_path: Path to the GGUF model file
+        :param n_ctx: Context size
+        :param n_threads: Number of threads, None lets llama.cpp decide
+        """
+        self.model_path = model_path
+        self.n_ctx = n_ctx
+        self.n_threads = n_threads
+        self.llm = None
+        self.grammar = None
+        self.lock = asyncio.Lock()
+        self.lease = None
+
+    async def start(self, client):
+        from llama_cpp import Llama, LlamaGrammar
+        from resource_governor import get_governor
+
+        self.lease = await get_governor().acquire_async("llama", threads=self.n_threads, name=self.model_path)
+        try:
+            self.llm = await asyncio.to_thread(Llama, model_path=self.model_path, n_ctx=self.n_ctx,
+                                               n_threads=self.lease.threads, use_mmap=True, verbose=False)
+            self.grammar = LlamaGrammar.from_string(REFINEMENT_GBNF, verbose=False)
+        except BaseException:
+            # A bad model path must not keep the thread budget
+            await self.stop()
+            raise
+
+    async def complete(self, client, original_text, instruction, max_tokens, temperature, structured=False,
+                       timeout=None):
+        if structured:
+            kwargs = {"prompt": build_structured_prompt(original_text, instruction), "grammar": self.grammar}
+        else:
+            kwargs = {"prompt": build_prompt(original_text, instruction), "stop": ["\n"]}
+        # A llama context is not re-entrant, so generations on one model are serialized
+        async with self.lock:
+            start = time.perf_counter()
+            result = await asyncio.to_thread(self.llm, max_tokens=max_tokens, temperature=temperature, **kwargs)
+            elapsed = time.perf_counter() - start
+        predicted = result['usage']['completion_tokens']
+        timings = {"predicted_n": predicted, "predicted_per_second": predicted / elapsed if elapsed else 0.0}
+        return result['choices'][0]['text'], timings
+
+    async def stop(self):
+        self.llm = None
+        if self.lease:
+            self.lease.release()
+            self.lease = None
+
+
+# Per-process state of the llama-cpp-python worker pool, set by _worker_init
+_worker_llm = None
+_worker_grammar = None
+_worker_barrier = None
+
+
+def _worker_init(model_path, n_ctx, n_threads, barrier):
+    """
+    Load the model once per worker process. Weights are mmap'd, so every worker
+    maps the same page-cache pages and the pool costs one copy of the weights.
+    """
+    global _worker_llm, _worker_grammar, _worker_barrier
+    from llama_cpp import Llama, LlamaGrammar
+
+    _worker_barrier = barrier
+
+    _worker_llm = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads,
+                        use_mmap=True, verbose=False)
+    _worker_grammar = LlamaGrammar.from_string(REFINEMENT_GBNF, verbose=False)
+
+
+def _worker_ready():
+    # Every worker blocks here until all have loaded, so each takes exactly one ready task
+    _worker_barrier.wait()
+    return os.getpid()
+
+
+def _worker_complete(original_text, instruction, max_tokens, temperature, structured):
+    if structured:
+        kwargs = {"prompt": build_structured_prompt(original_text, instruction), "grammar": _worker_grammar}
+    else:
+        kwargs = {"prompt": build_prompt(original_text, instruction), "stop": ["\n"]}
+    start = time.perf_counter()
+    result = _worker_llm(max_tokens=max_tokens, temperature=temperature, **kwargs)
+    elapsed = time.perf_counter() - start
+    predicted = result['usage']['completion_tokens']
+    timings = {"predicted_n": predicted, "predicted_per_second": predicted / elapsed if elapsed else 0.0,
+               "worker_pid": os.getpid()}
+    return result['choices'][0]['text'], timings
+
+
+class LlamaCppPoolBackend:
+    """
+    Pool of worker processes each running an in-process llama-cpp-python model,
+    so several refinements run in parallel without a server or HTTP round trips.
+    """
+    name = "llama-cpp-pool"
+
+    def __init__(self, model_path, workers=2, n_ctx=4096, threads_per_worker=None, threads=None):
+        """
+        :param model_path: Path to the GGUF model file
+        :param workers: Number of worker processes
+        :param n_ctx: Context size of each worker
+        :param threads_per_worker: Threads per worker, defaults to an even split of `threads`
+        :param threads: Threads of the whole pool when threads_per_worker is not given,
+            defaults to the CPU budget
+        """
+        self.model_path = model_path
+        self.workers = workers
+        self.n_ctx = n_ctx
+        self.threads_per_worker = threads_per_worker
+        self.threads = threads
+        self.executor = None
+        self.lease = None
+
+    async def start(self, client):
+        from resource_governor import get_governor
+
+        # One budget for the whole pool, split evenly between the workers
+        governor = get_governor()
+        requested = (self.threads_per_worker * self.workers if self.threads_per_worker
+                     else self.threads or governor.cpu_budget)
+        self.lease = await governor.acquire_async("llama", threads=requested, name=self.model_path)
+        threads_per_worker = max(1, self.lease.threads // self.workers)
+
+        try:
+            # Fork where available: workers start quickly and share the parent's imports
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("fork" if "fork" in methods else None)
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=context, initializer=_worker_init,
+                initargs=(self.model_path, self.n_ctx, threads_per_worker,
+                          context.Barrier(self.workers))
+            )
+            # Load the model in every worker up front instead of on the first requests
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*(loop.run_in_executor(self.executor, _worker_ready)
+                                   for _ in range(self.workers)))
+        except BaseException:
+            # A broken pool must not keep the whole thread budget
+            await self.stop()
+            raise
+
+    async def complete(self, client, original_text, instruction, max_tokens, temperature, structured=False,
+                       timeout=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, _worker_complete, original_text,
+                                          instruction, max_tokens, temperature, structured)
+
+    async def stop(self):
+        # The workers are idle once the engine stops; release before waiting for them to exit
+        if self.lease:
+            self.lease.release()
+            self.lease = None
+        if self.executor:
+            await asyncio.to_thread(self.executor.shutdown, wait=True)
+            self.executor = None
+
+
+class RefinementEngine:
+    """
+    Backend-independent refinement engine.
+
+    Owns one pooled HTTP client for the backend, an LRU cache of refinements,
+    per-engine metrics and a concurrency limit for batches of refinements.
+    """
+
+    def __init__(self, backend, cache_size=128, max_concurrency=4, timeout=30.0):
+        """
+        :param backend: RefinementBackend implementation
+        :param cache_size: Number of refinements kept in the LRU cache, 0 to disable
+        :param max_concurrency: Maximum number of refinements in flight at once
+        :param timeout: Timeout of each HTTP request in seconds
+        """
+        self.backend = backend
+        self.cache_size = cache_size
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.client = None
+        self.cache = OrderedDict()
+        self.semaphore = None
+        self.last_timings = None
+        self.metrics = {"requests": 0, "cache_hits": 0, "errors": 0, "latency_seconds": 0.0}
+
+    async def start(self):
+        import httpx
+
+        self.client = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.max_concurrency,
+                                max_keepalive_connections=self.max_concurrency)
+        )
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        try:
+            await self.backend.start(self.client)
+        except BaseException:
+            # __aexit__ does not run when start() raises, so close the client here
+            await self.stop()
+            raise
+
+    async def stop(self):
+        await self.backend.stop()
+        if self.client:
+            await self.client.aclose()
+            self.client = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop()
+
+    async def _generate(self, original_text, instruction, max_tokens, temperature, structured):
+        key = (self.backend.name, original_text, instruction, max_tokens, temperature, structured)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.metrics["cache_hits"] += 1
+            return self.cache[key]
+
+        from resilience import ServiceError, get_service
+
+        async with self.semaphore:
+            self.metrics["requests"] += 1
+            start = time.perf_counter()
+            try:
+                # Deadline, retries, hedging and the circuit breaker are shared per backend;
+                # hosted backends also wait for their provider rate limit before each attempt
+                throttle = getattr(self.backend, "throttle", None)
+                content, self.last_timings = await get_service(self.backend.name).acall(
+                    lambda timeout: self.backend.complete(
+                        self.client, original_text, instruction, max_tokens, temperature, structured,
+                        timeout=timeout),
+                    before_attempt=throttle and (
+                        lambda: throttle(original_text, instruction, max_tokens, structured)))
+            except ServiceError as e:
+                self.metrics["errors"] += 1
+                print(f"{self.backend.name} request error: {e}")
+                raise
+            finally:
+                self.metrics["latency_seconds"] += time.perf_counter() - start
+
+        result = parse_structured_refinement(content) if structured else content.strip()
+        if result is not None and self.cache_size:
+            self.cache[key] = result
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return result
+
+    async def refine(self, original_text, instruction="Rewrite the text to be more concise",
+                     max_tokens=150, temperature=0.7):
+        """
+        :param original_text: Text to be modified
+        :param instruction: Specific instruction for text modification
+        :param max_tokens: Maximum number of tokens to generate
+        :param temperature: Sampling temperature for text generation
+        :return: Modified text
+        :raises ServiceError: If the backend fails for good
+        """
+        return await self._generate(original_text, instruction, max_tokens, temperature, False)
+
+    async def refine_structured(self, original_text, instruction="Rewrite the text to be more concise",
+                                max_tokens=1024, temperature=0.7):
+        """
+        :param original_text: Text to be modified
+        :param instruction: Specific instruction for text modification
+        :param max_tokens: Maximum number of tokens to generate
+        :param temperature: Sampling temperature for text generation
+        :return: Dict with 'refined_text', 'segments' and 'strategy', or None if the
+            model output does not match the schema
+        :raises ServiceError: If the backend fails for good
+        """
+        return await self._generate(original_text, instruction, max_tokens, temperature, True)
+
+    async def refine_many(self, original_text, instructions, structured=False, **kwargs):
+        """
+        Run several refinements of one text concurrently, up to max_concurrency at once.
+
+        :param original_text: Text to be modified
+        :param instructions: List of instructions
+        :param structured: Return structured refinements
+        :return: List of results in the order of `instructions`
+        :raises ServiceError: If any refinement fails for good
+        """
+        refine = self.refine_structured if structured else self.refine
+        return await asyncio.gather(*(refine(original_text, instruction, **kwargs)
+                                      for instruction in instructions))
+
+
+def create_backend(model_type='llama', **kwargs):
+    """
+    :param model_type: 'llama', 'openai', 'llama-cpp-python' or 'llama-cpp-pool'
+    :param kwargs: Keyword arguments of the backend
+    :return: RefinementBackend instance
+    """
+    backends = {
+        LlamaServerBackend.name: LlamaServerBackend,
+        OpenAIBackend.name: OpenAIBackend,
+        LlamaCppPythonBackend.name: LlamaCppPythonBackend,
+        LlamaCppPoolBackend.name: LlamaCppPoolBackend,
+    }
+    if model_type not in backends:
+        raise ValueError(f"Unknown model type '{model_type}', expected one of {list(backends)}")
+    return backends[model_type](**kwargs)
@@ -0,0 +1,390 @@
+import sys
+import time
+import random
+import asyncio
+import threading
+
+# Status codes worth another attempt: rate limiting and server-side failures
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class ServiceError(RuntimeError):
+    """
+    An external call failed for good: the error was not retryable, the retries or
+    the deadline ran out, or the service's circuit breaker is open.
+    """
+
+    def __init__(self, service, message):
+        super().__init__(f"{service}: {message}")
+        self.service = service
+
+
+class CircuitOpenError(ServiceError):
+    pass
+
+
+def status_of(exc):
+    """
+    :return: HTTP status code carried by an httpx/requests/SDK exception, or None
+    """
+    response = getattr(exc, "response", None)
+    for value in (getattr(response, "status_code", None), getattr(exc, "status_code", None),
+                  getattr(exc, "status", None)):
+        # The Deepgram SDK reports the status as a string
+        if isinstance(value, str) and value.isdigit():
+            value = int(value)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def is_retryable(exc):
+    """
+    Decide whether a failed call may succeed on another attempt. HTTP errors are
+    retried on 429/5xx only; connection errors and timeouts are always retried.
+    """
+    status = status_of(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    if isinstance(exc, (ConnectionError, TimeoutError, asyncio.TimeoutError)):
+        return True
+    # Only look at the HTTP libraries that are already loaded, never import them here
+    httpx = sys.modules.get("httpx")
+    if httpx is not None and isinstance(exc, httpx.TransportError):
+        return True
+    requests = sys.modules.get("requests")
+    if requests is not None and isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+        return True
+    return False
+
+
+def retry_after(exc):
+    """
+    :return: Seconds requested by a Retry-After header, or None
+    """
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class Deadline:
+    """
+    Overall time budget of a call, shared by all its attempts and backoff sleeps.
+    """
+
+    def __init__(self, seconds):
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+
+class CircuitBreaker:
+    """
+    Stop calling a service that keeps failing. After `failure_threshold`
+    consecutive failures the circuit opens and calls fail immediately; after
+    `reset_timeout` seconds one trial call is let through (half-open) and its
+    outcome closes or reopens the circuit.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half-open"
+                self.trial_in_flight = False
+            if self.state == "half-open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = "closed"
+            self.failures = 0
+            self.trial_in_flight = False
+
+    def release_trial(self):
+        """
+        End a call that says nothing about the service's health: a request it
+        rejected as invalid, or an attempt that was cancelled. It counts neither as
+        a success nor as a failure, but frees a half-open trial for the next call.
+        """
+        with self.lock:
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        """
+        :return: True if this failure opened the circuit
+        """
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.state == "half-open" or self.failures >= self.failure_threshold:
+                opened = self.state != "open"
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                return opened
+            return False
+
+
+class Service:
+    """
+    Resilience policy of one external service: a deadline per call, jittered
+    exponential backoff on retryable errors, optional hedging of slow async
+    attempts and a circuit breaker. Every call is counted in `metrics`.
+    """
+
+    def __init__(self, name, deadline=60.0, attempt_timeout=None, retries=3, base_delay=0.5,
+                 max_delay=8.0, hedge_after=None, failure_threshold=5, reset_timeout=30.0,
+                 interruptible=True):
+        """
+        :param name: Service name used in errors and reports
+        :param deadline: Seconds for the whole call including retries
+        :param attempt_timeout: Seconds per attempt, capped by what is left of the deadline
+        :param retries: Additional attempts after the first one
+        :param base_delay: Backoff before the first retry, doubled per retry
+        :param max_delay: Upper bound of a single backoff
+        :param hedge_after: Seconds after which a slow async attempt is raced by a
+            duplicate; None disables hedging (use it only for idempotent calls)
+        :param failure_threshold: Consecutive failures that open the circuit
+        :param reset_timeout: Seconds the circuit stays open before a trial call
+        :param interruptible: False for work that keeps running when abandoned, e.g.
+            an in-process model in a thread: attempts are then neither timed out nor
+            hedged, and get None as their timeout
+        """
+        self.name = name
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge_after = hedge_after
+        self.interruptible = interruptible
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.metrics = {"calls": 0, "attempts": 0, "retries": 0, "hedges": 0, "hedge_wins": 0,
+                        "failures": 0, "rejected": 0, "circuit_opens": 0, "latency_seconds": 0.0}
+        self.metrics_lock = threading.Lock()
+
+    def _count(self, key, value=1):
+        with self.metrics_lock:
+            self.metrics[key] += value
+
+    def _backoff(self, attempt, exc):
+        # Full jitter keeps concurrent jobs from retrying in lockstep
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(delay, retry_after(exc) or 0.0)
+
+    def _attempt_timeout(self, deadline):
+        if not self.interruptible:
+            return None
+        remaining = deadline.remaining()
+        return min(remaining, self.attempt_timeout) if self.attempt_timeout else remaining
+
+    def _admit(self):
+        if not self.breaker.allow():
+            self._count("rejected")
+            raise CircuitOpenError(self.name, "circuit open after repeated failures")
+
+    def _failed(self, exc, attempt, deadline):
+        """
+        Record a failed attempt and decide what happens next.
+
+        :return: Seconds to sleep before retrying
+        :raises ServiceError: If the call must not be retried
+        """
+        if not is_retryable(exc):
+            # A rejected request (bad key, bad payload) says nothing about the service's health
+            self.breaker.release_trial()
+            self._count("failures")
+            raise ServiceError(self.name, f"{type(exc).__name__}: {exc}") from exc
+        reason = str(exc) or type(exc).__name__
+        if self.breaker.record_failure():
+            self._count("circuit_opens")
+            print(f"{self.name}: circuit opened after {self.breaker.failures} failures")
+        if attempt >= self.retries:
+            self._count("failures")
+            raise ServiceError(self.name, f"gave up after {attempt + 1} attempts: {reason}") from exc
+        delay = self._backoff(attempt, exc)
+        if delay >= deadline.remaining():
+            self._count("failures")
+            raise ServiceError(self.name, f"deadline exceeded after {attempt + 1} attempts: {reason}") from exc
+        self._count("retries")
+        print(f"{self.name}: attempt {attempt + 1} failed ({reason}), retrying in {delay:.1f}s")
+        return delay
+
+    def call(self, fn, before_attempt=None):
+        """
+        Call a blocking function under this policy.
+
+        :param fn: Function taking the timeout in seconds for this attempt (None if
+            the service is not interruptible)
+        :param before_attempt: Optional function run before every attempt outside its
+            timeout, e.g. a rate limiter; the deadline starts after the first one
+        :return: Result of fn
+        :raises ServiceError: When the call fails for good
+        """
+        self._count("calls")
+        deadline = None
+        start = time.perf_counter()
+        try:
+            for attempt in range(self.retries + 1):
+                self._admit()
+                try:
+                    if before_attempt:
+                        before_attempt()
+                    deadline = deadline or Deadline(self.deadline)
+                    self._count("attempts")
+                    try:
+                        result = fn(self._attempt_timeout(deadline))
+                    except Exception as e:
+                        delay = self._failed(e, attempt, deadline)
+                    else:
+                        self.breaker.record_success()
+                        return result
+                except BaseException:
+                    # Interrupted before an outcome was recorded; a pending trial must not block the circuit
+                    self.breaker.release_trial()
+                    raise
+                time.sleep(delay)
+        finally:
+            self._count("latency_seconds", time.perf_counter() - start)
+
+    async def acall(self, coro_fn, before_attempt=None):
+        """
+        Await a coroutine under this policy. Each attempt is bounded by the
+        deadline and, if hedging is enabled, raced by a duplicate once it is slow.
+
+        :param coro_fn: Function taking the timeout in seconds (None if the service is
+            not interruptible) and returning a coroutine
+        :param before_attempt: Optional coroutine function awaited before every attempt
+            (and hedge) outside its timeout, e.g. a rate limiter; the deadline starts
+            after the first one
+        :return: Result of the coroutine
+        :raises ServiceError: When the call fails for good
+        """
+        self._count("calls")
+        deadline = None
+        start = time.perf_counter()
+        try:
+            for attempt in range(self.retries + 1):
+                self._admit()
+                try:
+                    if before_attempt:
+                        await before_attempt()
+                    deadline = deadline or Deadline(self.deadline)
+                    self._count("attempts")
+                    try:
+                        result = await self._hedged(coro_fn, deadline, before_attempt)
+                    except Exception as e:
+                        delay = self._failed(e, attempt, deadline)
+                    else:
+                        self.breaker.record_success()
+                        return result
+                except BaseException:
+                    # Cancelled before an outcome was recorded; a pending trial must not block the circuit
+                    self.breaker.release_trial()
+                    raise
+                await asyncio.sleep(delay)
+        finally:
+            self._count("latency_seconds", time.perf_counter() - start)
+
+    async def _hedged(self, coro_fn, deadline, before_attempt=None):
+        timeout = self._attempt_timeout(deadline)
+        if timeout is None:
+            return await coro_fn(None)
+        if not self.hedge_after or self.hedge_after >= timeout:
+            return await asyncio.wait_for(coro_fn(timeout), timeout)
+
+        primary = asyncio.ensure_future(coro_fn(timeout))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+            if not done:
+                if before_attempt:
+                    # The duplicate is a real request and takes its share of the rate limit
+                    await before_attempt()
+                self._count("hedges")
+                tasks.add(asyncio.ensure_future(coro_fn(self._attempt_timeout(deadline))))
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, timeout=deadline.remaining(),
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise asyncio.TimeoutError(f"no response within the {self.deadline}s deadline")
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self._count("hedge_wins")
+                        return task.result()
+                # Every finished attempt failed; surface the error once none are left
+                if not tasks:
+                    raise done.pop().exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+# Defaults per service. Nothing is hedged by default: uploads and renders are not
+# idempotent or are too large to send twice, and a duplicate completion is billed
+# and rate limited. Pass hedge_after to get_service() to opt in.
+SERVICE_DEFAULTS = {
+    "deepgram": {"deadline": 600.0, "attempt_timeout": 300.0, "retries": 3},
+    "openai": {"deadline": 90.0, "attempt_timeout": 30.0, "retries": 4},
+    "llama": {"deadline": 120.0, "attempt_timeout": 60.0, "retries": 2},
+    "simli": {"deadline": 180.0, "attempt_timeout": 120.0, "retries": 2},
+    "elevenlabs": {"deadline": 180.0, "attempt_timeout": 60.0, "retries": 3},
+    # In-process models fail deterministically and an abandoned generation keeps its
+    # threads busy, so they are neither retried, timed out nor hedged
+    "llama-cpp-python": {"retries": 0, "interruptible": False},
+    "llama-cpp-pool": {"retries": 0, "interruptible": False},
+}
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_service(name, **overrides):
+    """
+    Return the process-wide policy of a service, so all concurrent jobs share its
+    circuit breaker and metrics.
+
+    :param name: Service name, e.g. 'deepgram', 'openai', 'llama' or 'simli'
+    :param overrides: Service arguments used when the service is first created
+    :return: Service
+    """
+    with _services_lock:
+        if name not in _services:
+            _services[name] = Service(name, **dict(SERVICE_DEFAULTS.get(name, {}), **overrides))
+        return _services[name]
+
+
+def report():
+    """
+    :return: Dict per service with its metrics and circuit state
+    """
+    with _services_lock:
+        services = dict(_services)
+    return {name: dict(service.metrics, circuit=service.breaker.state)
+            for name, service in sorted(services.items())}
+
+
+def print_report():
+    print(f"{'service':<10}{'calls':>7}{'retries':>9}{'hedges':>8}{'failed':>8}{'rejected':>10}  circuit")
+    for name, row in report().items():
+        print(f"{name:<10}{row['calls']:>7}{row['retries']:>9}{row['hedges']:>8}{row['failures']:>8}"
+              f"{row['rejected']:>10}  {row['circuit']}")
@@ -0,0 +1,223 @@
+import os
+import time
+import asyncio
+import threading
+import statistics
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+
+
+class Lease:
+    """
+    Resources granted to one job by the ResourceGovernor. Release it (or leave the
+    `lease()` block) when the job is done so queued jobs can start.
+    """
+
+    def __init__(self, governor, kind, name, threads, memory, wait):
+        self.governor = governor
+        self.kind = kind
+        self.name = name
+        self.threads = threads
+        self.memory = memory
+        self.wait = wait
+        self.started = time.perf_counter()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.governor._release(self)
+
+
+class _Ticket:
+    """
+    A queued request for resources; async waiters also carry the future to resolve.
+    """
+
+    def __init__(self, kind, name, threads, memory):
+        self.kind = kind
+        self.name = name
+        self.threads = threads
+        self.memory = memory
+        self.start = time.perf_counter()
+        self.granted = False
+        self.loop = None
+        self.future = None
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class ResourceGovernor:
+    """
+    Process-wide admission control for CPU threads and in-memory audio buffers.
+
+    Every ffmpeg run, llama server/model and upload asks for a thread budget and/or
+    a memory budget before it starts. When the budget is exhausted the job waits in
+    FIFO order until earlier jobs release theirs, so concurrent Pitch jobs share the
+    machine instead of oversubscribing it. Wait and run times are recorded per job.
+    """
+
+    def __init__(self, cpu_budget=None, memory_budget=1024 ** 3, default_threads=None):
+        """
+        :param cpu_budget: Total threads handed out at once, defaults to the number of cores
+        :param memory_budget: Total bytes of in-memory audio buffers at once
+        :param default_threads: Threads granted per job kind when the caller does not ask
+        """
+        self.cpu_budget = cpu_budget or os.cpu_count() or 1
+        self.memory_budget = memory_budget
+        self.default_threads = {
+            "llama": max(1, self.cpu_budget // 2),
+            "whisper": max(1, self.cpu_budget // 2),
+            "ffmpeg": min(2, self.cpu_budget),
+        }
+        self.default_threads.update(default_threads or {})
+        self.threads_in_use = 0
+        self.memory_in_use = 0
+        self.condition = threading.Condition()
+        self.queue = deque()
+        self.records = []
+
+    def _ticket(self, kind, threads, memory, name):
+        if threads is None:
+            threads = self.default_threads.get(kind, 0)
+        # A single job larger than the whole budget runs alone rather than never
+        return _Ticket(kind, name, min(threads, self.cpu_budget), min(memory, self.memory_budget))
+
+    def _grant(self):
+        """
+        Grant queued tickets in FIFO order while the head of the queue fits. Call
+        with the condition held.
+        """
+        while self.queue:
+            ticket = self.queue[0]
+            if (self.threads_in_use + ticket.threads > self.cpu_budget
+                    or self.memory_in_use + ticket.memory > self.memory_budget):
+                break
+            self.queue.popleft()
+            self.threads_in_use += ticket.threads
+            self.memory_in_use += ticket.memory
+            ticket.granted = True
+            if ticket.future is not None:
+                ticket.loop.call_soon_threadsafe(_resolve, ticket.future)
+        self.condition.notify_all()
+
+    def _lease(self, ticket):
+        return Lease(self, ticket.kind, ticket.name, ticket.threads, ticket.memory,
+                     time.perf_counter() - ticket.start)
+
+    def acquire(self, kind, threads=None, memory=0, name=None):
+        """
+        Block until the requested resources are available.
+
+        :param kind: Job kind, e.g. 'ffmpeg', 'llama', 'upload'
+        :param threads: Threads needed, defaults to default_threads[kind] (0 if unknown)
+        :param memory: Bytes of buffers needed
+        :param name: Optional job name for the report
+        :return: Lease
+        """
+        ticket = self._ticket(kind, threads, memory, name)
+        with self.condition:
+            self.queue.append(ticket)
+            self._grant()
+            self.condition.wait_for(lambda: ticket.granted)
+        return self._lease(ticket)
+
+    async def acquire_async(self, kind, threads=None, memory=0, name=None):
+        """
+        Same as acquire() without blocking the event loop. The waiter is a future
+        resolved by whoever frees the resources, so no thread is parked while it waits.
+        """
+        ticket = self._ticket(kind, threads, memory, name)
+        ticket.loop = asyncio.get_running_loop()
+        ticket.future = ticket.loop.create_future()
+        with self.condition:
+            self.queue.append(ticket)
+            self._grant()
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            with self.condition:
+                if not ticket.granted:
+                    self.queue.remove(ticket)
+                    # The cancelled ticket may have been holding back the ones behind it
+                    self._grant()
+            if ticket.granted:
+                self._lease(ticket).release()
+            raise
+        return self._lease(ticket)
+
+    def _release(self, lease):
+        with self.condition:
+            self.threads_in_use -= lease.threads
+            self.memory_in_use -= lease.memory
+            self.records.append({
+                "kind": lease.kind,
+                "name": lease.name,
+                "threads": lease.threads,
+                "memory": lease.memory,
+                "wait": lease.wait,
+                "run": time.perf_counter() - lease.started,
+            })
+            self._grant()
+
+    @contextmanager
+    def lease(self, kind, threads=None, memory=0, name=None):
+        lease = self.acquire(kind, threads, memory, name)
+        try:
+            yield lease
+        finally:
+            lease.release()
+
+    @asynccontextmanager
+    async def alease(self, kind, threads=None, memory=0, name=None):
+        lease = await self.acquire_async(kind, threads, memory, name)
+        try:
+            yield lease
+        finally:
+            lease.release()
+
+    def report(self):
+        """
+        :return: Dict per job kind with the number of jobs and their mean/max wait and run seconds
+        """
+        with self.condition:
+            records = list(self.records)
+        summary = {}
+        for kind in sorted({record["kind"] for record in records}):
+            waits = [record["wait"] for record in records if record["kind"] == kind]
+            runs = [record["run"] for record in records if record["kind"] == kind]
+            summary[kind] = {
+                "jobs": len(waits),
+                "mean_wait": statistics.fmean(waits),
+                "max_wait": max(waits),
+                "mean_run": statistics.fmean(runs),
+                "max_run": max(runs),
+            }
+        return summary
+
+    def print_report(self):
+        print(f"{'kind':<10}{'jobs':>6}{'wait avg':>10}{'wait max':>10}{'run avg':>10}{'run max':>10}")
+        for kind, row in self.report().items():
+            print(f"{kind:<10}{row['jobs']:>6}{row['mean_wait']:>10.2f}{row['max_wait']:>10.2f}"
+                  f"{row['mean_run']:>10.2f}{row['max_run']:>10.2f}")
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+def get_governor():
+    """
+    :return: The process-wide ResourceGovernor, configured from PITCH_CPU_BUDGET and
+        PITCH_MEMORY_BUDGET_MB when set
+    """
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            cpu_budget = int(os.getenv("PITCH_CPU_BUDGET", 0)) or None
+            memory_mb = int(os.getenv("PITCH_MEMORY_BUDGET_MB", 1024))
+            _governor = ResourceGovernor(cpu_budget=cpu_budget, memory_budget=memory_mb * 1024 ** 2)
+        return _governor
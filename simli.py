@@ -1,13 +1,27 @@
 import os
+from functools import lru_cache
 from pydantic import BaseModel
-import requests
 
-SIMLI_URL= "https://api.simli.ai/textToVideoStream"    
+# Overridable so benchmarks and tests can point renders at a local stub
+SIMLI_URL = os.getenv("SIMLI_URL", "https://api.simli.ai/textToVideoStream")
+
+@lru_cache(maxsize=None)
+def get_session():
+    """
+    Process-wide HTTP session, so renders reuse pooled connections to Simli
+    and `requests` is only imported once a render is requested.
+    """
+    import requests
+    return requests.Session()
 
 class Simli(BaseModel):
     text: str
 
     def get_video_url(self):
+        """
+        :return: HLS URL of the rendered avatar video
+        :raises ServiceError: If Simli fails for good or returns no URL
+        """
         payload = {
             "ttsAPIKey": os.getenv("ELEVENLABS_API_KEY"),
             "simliAPIKey": os.getenv("SIMLI_API_KEY"),
@@ -25,9 +39,20 @@ class Simli(BaseModel):
             }
         }
         headers = {"Content-Type": "application/json"}
-        response = requests.request("POST", SIMLI_URL, json=payload, headers=headers)
-        response_data = response.json()
-        if response.status_code == 200:
-            hls_url = response_data.get('hls_url')
-            return hls_url
-        
\ No newline at end of file
+
+        from resilience import ServiceError, get_service
+        from rate_limit import get_limiter
+
+        def post(timeout):
+            response = get_session().request("POST", SIMLI_URL, json=payload, headers=headers,
+                                             timeout=timeout)
+            # Check the status first: error responses are not always JSON
+            response.raise_for_status()
+            return response.json()
+
+        # Every attempt, retries included, first waits for the shared request budget
+        response_data = get_service("simli").call(post, before_attempt=get_limiter("simli").acquire)
+        hls_url = response_data.get('hls_url')
+        if not hls_url:
+            raise ServiceError("simli", f"response has no hls_url: {response_data}")
+        return hls_url
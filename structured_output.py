@@ -0,0 +1,106 @@
+import json
+
+# JSON schema of a structured refinement: the full refined text, the refined text
+# split per segment (sentence) next to the original it replaces, and the strategy
+# that was applied. Used as the OpenAI `response_format`.
+REFINEMENT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "refined_text": {"type": "string"},
+        "segments": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "original": {"type": "string"},
+                    "refined": {"type": "string"}
+                },
+                "required": ["original", "refined"],
+                "additionalProperties": False
+            }
+        },
+        "strategy": {
+            "type": "object",
+            "properties": {
+                "tone": {"type": "string"},
+                "focus": {"type": "string"},
+                "instruction": {"type": "string"}
+            },
+            "required": ["tone", "focus", "instruction"],
+            "additionalProperties": False
+        }
+    },
+    "required": ["refined_text", "segments", "strategy"],
+    "additionalProperties": False
+}
+
+# The same shape as a GBNF grammar for llama.cpp, so the server can only sample
+# tokens that keep the output a valid refinement object.
+REFINEMENT_GBNF = r'''
+root ::= "{" ws "\"refined_text\":" ws string "," ws "\"segments\":" ws segments "," ws "\"strategy\":" ws strategy ws "}"
+segments ::= "[" ws ( segment ( "," ws segment )* )? ws "]"
+segment ::= "{" ws "\"original\":" ws string "," ws "\"refined\":" ws string ws "}"
+strategy ::= "{" ws "\"tone\":" ws string "," ws "\"focus\":" ws string "," ws "\"instruction\":" ws string ws "}"
+string ::= "\"" ( [^"\\\x7F\x00-\x1F] | "\\" ( ["\\/bfnrt] | "u" [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F] ) )* "\""
+ws ::= [ \t\n]{0,20}
+'''
+
+
+def build_structured_prompt(original_text, instruction):
+    """
+    Build the prompt asking for a structured refinement.
+
+    :param original_text: Text to be modified
+    :param instruction: Specific instruction for text modification
+    :return: Prompt text
+    """
+    return (
+        f"{instruction}\n\n"
+        "Respond with a JSON object with the keys 'refined_text' (the full modified text), "
+        "'segments' (a list of objects with the 'original' sentence and its 'refined' version, "
+        "in order) and 'strategy' (an object with the 'tone', 'focus' and 'instruction' you applied).\n\n"
+        f"Original Text: {original_text}\n\nJSON:"
+    )
+
+
+def openai_response_format(name="pitch_refinement"):
+    """
+    Build the OpenAI `response_format` for a strict JSON schema response.
+
+    :param name: Name of the schema
+    :return: response_format payload
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": name, "strict": True, "schema": REFINEMENT_SCHEMA}
+    }
+
+
+def parse_structured_refinement(content):
+    """
+    Parse and validate a structured refinement returned by the model.
+
+    :param content: Raw JSON text returned by the model
+    :return: Refinement dict, or None if the response is not a valid refinement
+    """
+    try:
+        result = json.loads(content)
+    except (TypeError, json.JSONDecodeError) as e:
+        print(f"Error parsing structured refinement: {e}")
+        return None
+
+    if not isinstance(result, dict) or not isinstance(result.get("refined_text"), str):
+        print("Structured refinement is missing 'refined_text'")
+        return None
+
+    segments = result.get("segments")
+    if not isinstance(segments, list):
+        segments = []
+    result["segments"] = [
+        segment for segment in segments
+        if isinstance(segment, dict) and isinstance(segment.get("refined"), str)
+    ]
+    if not isinstance(result.get("strategy"), dict):
+        result["strategy"] = {}
+    result["refined_text"] = result["refined_text"].strip()
+    return result
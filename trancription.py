@@ -1,54 +1,260 @@
-
-
 from pydantic import BaseModel
-from deepgram import (
-    DeepgramClient,
-    PrerecordedOptions,
-    FileSource,
-)
 import os
+import re
+import json
+from abc import ABC, abstractmethod
 from datetime import datetime
-import httpx
 
 
-class Transcriber(BaseModel):
-    audo_file_path: str
-    
-    def _transcribe(self):
-        deepgram = DeepgramClient(api_key=os.getenv("DEEPGRAM"))
+class TranscriptionBackend(ABC):
+    """
+    Base class of transcription engines. Every backend returns a Deepgram-shaped
+    response dict, so `results.channels[0].alternatives[0].words` with
+    `start`/`end`/`confidence` is available to the rest of the pipeline whatever
+    engine produced it.
+    """
+    name = "base"
+
+    @abstractmethod
+    def transcribe_file(self, audio_path):
+        """
+        Transcribe one audio file.
+
+        :param audio_path: Path to the audio file
+        :return: Deepgram-shaped response dict
+        """
+
+    def transcribe_many(self, audio_paths):
+        """
+        Transcribe several audio files with the same backend instance.
+
+        :param audio_paths: Paths to the audio files
+        :return: List of Deepgram-shaped response dicts, in order
+        """
+        return [self.transcribe_file(audio_path) for audio_path in audio_paths]
+
+    def leased_threads(self):
+        """
+        :return: CPU threads leased from the resource governor per transcription
+        """
+        return 0
+
+
+class DeepgramBackend(TranscriptionBackend):
+    name = "deepgram"
+
+    def __init__(self, api_key=None, model="nova-2"):
+        """
+        :param api_key: Deepgram API key, defaults to the DEEPGRAM environment variable
+        :param model: Deepgram model name
+        """
+        self.api_key = api_key or os.getenv("DEEPGRAM")
+        self.model = model
+        self.client = None
+
+    def transcribe_file(self, audio_path):
+        from deepgram import DeepgramClient, PrerecordedOptions, FileSource
+        import httpx
+        from resource_governor import get_governor
+        from resilience import get_service
+        from rate_limit import get_limiter
+
+        if self.client is None:
+            self.client = DeepgramClient(api_key=self.api_key)
+
+        # The whole file is buffered for the upload, so it counts against the memory budget
+        with get_governor().lease("upload", memory=os.path.getsize(audio_path), name=audio_path):
+            # STEP 2 Call the transcribe_file method on the rest class
+            with open(audio_path, "rb") as file:
+                buffer_data = file.read()
+
+            payload: FileSource = {
+                "buffer": buffer_data,
+            }
+
+            # STEP 2 Call the transcribe_url method on the prerecorded class
+            options = PrerecordedOptions(
+                model=self.model,
+                smart_format=True,
+                summarize="v2",
+            )
+            # Deadline, jittered retries on 429/5xx and the circuit breaker are shared by all
+            # jobs; every attempt, retries included, first waits for the shared request budget
+            response = get_service("deepgram").call(
+                lambda timeout: self.client.listen.rest.v("1").transcribe_file(
+                    payload, options, timeout=httpx.Timeout(timeout, connect=10.0)
+                ),
+                before_attempt=get_limiter("deepgram").acquire
+            )
+        return json.loads(response.to_json())
+
+
+class FasterWhisperBackend(TranscriptionBackend):
+    """
+    Local CPU transcription with faster-whisper. The model is loaded once per
+    backend instance and reused for every file, so batches of files only pay the
+    load cost once and no audio leaves the machine.
+    """
+    name = "faster-whisper"
+
+    def __init__(self, model_size="small.en", device="cpu", compute_type="int8",
+                 cpu_threads=0, batch_size=0):
+        """
+        :param model_size: Whisper model size or path to a converted model
+        :param device: 'cpu' or 'cuda'
+        :param compute_type: CTranslate2 compute type, int8 is fastest on CPU
+        :param cpu_threads: Number of CPU threads, 0 for the resource governor's whisper allotment
+        :param batch_size: Batch size for batched inference within a file, 0 to disable
+        """
+        self.model_size = model_size
+        self.device = device
+        self.compute_type = compute_type
+        self.cpu_threads = cpu_threads
+        self.batch_size = batch_size
+        self.model = None
+
+    def leased_threads(self):
+        """
+        Threads the model is built with, and leased per file: the requested count, or
+        the governor's whisper allotment (never CTranslate2's all-cores default).
+        """
+        from resource_governor import get_governor
 
-        # STEP 2 Call the transcribe_file method on the rest class
-        with open(self.audo_file_path, "rb") as file:
-            buffer_data = file.read()
+        governor = get_governor()
+        return min(self.cpu_threads or governor.default_threads["whisper"], governor.cpu_budget)
 
-        payload: FileSource = {
-            "buffer": buffer_data,
+    def _load_model(self):
+        if self.model is None:
+            from faster_whisper import WhisperModel
+            # The thread count is fixed at load time, so size it to the lease taken per file
+            self.model = WhisperModel(self.model_size, device=self.device,
+                                      compute_type=self.compute_type,
+                                      cpu_threads=self.leased_threads())
+            if self.batch_size:
+                from faster_whisper import BatchedInferencePipeline
+                self.model = BatchedInferencePipeline(model=self.model)
+        return self.model
+
+    def transcribe_file(self, audio_path):
+        from resource_governor import get_governor
+
+        model = self._load_model()
+        kwargs = {"word_timestamps": True}
+        if self.batch_size:
+            kwargs["batch_size"] = self.batch_size
+
+        # Decoding is lazy, so the thread budget is held until every segment is read
+        with get_governor().lease("whisper", threads=self.leased_threads(), name=audio_path):
+            segments, info = model.transcribe(audio_path, **kwargs)
+            words = []
+            for segment in segments:
+                for word in segment.words or []:
+                    words.append((word.word.strip(), word.start, word.end, word.probability))
+        return deepgram_shaped_response(words, info.duration, f"faster-whisper-{self.model_size}")
+
+
+def deepgram_shaped_response(words, duration, model_name):
+    """
+    Build a Deepgram prerecorded response dict from word timings.
+
+    :param words: Iterable of (punctuated_word, start, end, confidence) tuples
+    :param duration: Duration of the audio in seconds
+    :param model_name: Name of the engine reported in the metadata
+    :return: Deepgram-shaped response dict
+    """
+    word_entries = []
+    for punctuated_word, start, end, confidence in words:
+        if not punctuated_word:
+            continue
+        word_entries.append({
+            "word": re.sub(r"[^\w'-]", "", punctuated_word).lower(),
+            "start": round(float(start), 3),
+            "end": round(float(end), 3),
+            "confidence": round(float(confidence), 6),
+            "punctuated_word": punctuated_word,
+        })
+
+    confidence = (sum(word["confidence"] for word in word_entries) / len(word_entries)
+                  if word_entries else 0.0)
+    return {
+        "metadata": {
+            "duration": duration,
+            "channels": 1,
+            "models": [model_name],
+        },
+        "results": {
+            "channels": [
+                {
+                    "alternatives": [
+                        {
+                            "transcript": " ".join(word["punctuated_word"] for word in word_entries),
+                            "confidence": confidence,
+                            "words": word_entries,
+                        }
+                    ]
+                }
+            ]
         }
+    }
+
+
+BACKENDS = {
+    DeepgramBackend.name: DeepgramBackend,
+    FasterWhisperBackend.name: FasterWhisperBackend,
+}
+
+_backend_instances = {}
+
 
-        # STEP 2 Call the transcribe_url method on the prerecorded class
-        options = PrerecordedOptions(
-            model="nova-2",
-            smart_format=True,
-            summarize="v2",
-        )
-        response = deepgram.listen.rest.v("1").transcribe_file(
-            payload, options, timeout=httpx.Timeout(300.0, connect=10.0)
-        )
+def get_backend(name="deepgram"):
+    """
+    Return the process-wide instance of a transcription backend, so a local
+    model is loaded only once no matter how many files are transcribed.
 
-        return response
+    :param name: Backend name, one of BACKENDS
+    :return: TranscriptionBackend instance
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown transcription backend '{name}', expected one of {list(BACKENDS)}")
+    if name not in _backend_instances:
+        _backend_instances[name] = BACKENDS[name]()
+    return _backend_instances[name]
+
+
+def transcribe_files(audio_paths, backend="deepgram"):
+    """
+    Transcribe a batch of files through one backend instance.
+
+    :param audio_paths: Paths to the audio files
+    :param backend: Backend name
+    :return: List of Deepgram-shaped JSON strings, in order
+    """
+    responses = get_backend(backend).transcribe_many(audio_paths)
+    return [json.dumps(response, indent=4) for response in responses]
+
+
+class Transcriber(BaseModel):
+    audo_file_path: str
+    backend: str = "deepgram"
+
+    def _transcribe(self):
+        return get_backend(self.backend).transcribe_file(self.audo_file_path)
 
     def transcribe(self):
+        """
+        :return: Deepgram-shaped response as a JSON string
+        :raises ServiceError: If the transcription service fails for good
+        """
+        from resilience import ServiceError
+
         try:
-            
             before = datetime.now()
             response = self._transcribe()
             after = datetime.now()
-            #print(response.to_json(indent=4))
-            #print("")
             difference = after - before
-            print(f"time: {difference.seconds}")       
+            print(f"time: {difference.seconds}")
 
-        except Exception as e:
+        except ServiceError as e:
             print(f"Exception: {e}")
-            raise RuntimeError(e)
-        return response.to_json(indent=4)
\ No newline at end of file
+            raise
+        return json.dumps(response, indent=4)
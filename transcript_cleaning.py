@@ -0,0 +1,120 @@
+import re
+import numpy as np
+
+# Hesitation sounds that carry no content; removed before prompting the LLM
+FILLER_WORDS = ["um", "umm", "uh", "uhh", "uhm", "er", "erm", "ah", "hmm", "mm", "mhm"]
+
+# Words commonly repeated on purpose ("very very", "no no"); their repeats are kept
+# unless the recognizer is unsure of them
+EMPHATIC_WORDS = ["very", "no", "so", "really", "yes", "yeah", "bye", "ha", "much", "many", "more", "never"]
+
+_TRAILING_PUNCTUATION = re.compile(r"[.,!?;:]+$")
+
+
+def estimate_tokens(text):
+    """
+    Estimate the number of LLM tokens in a text. Counts words and punctuation
+    marks, which tracks Llama/GPT BPE token counts closely for English speech.
+
+    :param text: Text to measure
+    :return: Estimated number of tokens
+    """
+    return len(re.findall(r"\w+|[^\w\s]", text or ""))
+
+
+def clean_words(words, filler_confidence=1.0, stutter_confidence=0.6, max_stutter_len=3,
+                max_repeat_gap=0.15, repeat_confidence=0.8):
+    """
+    Remove disfluencies from a Deepgram `words` array.
+
+    Three kinds of words are dropped, all decided with vectorized masks:
+    - immediate repetitions ("as as", "the the") spoken without a pause, keeping the
+      first occurrence; emphatic repeats ("very very") are only dropped at low confidence
+    - filler sounds ("um", "uh") with confidence below `filler_confidence`
+    - low-confidence stutters: a short word that is a prefix of the next word
+
+    :param words: Deepgram word dicts with 'word', 'confidence' and optionally 'punctuated_word'
+    :param filler_confidence: Fillers below this confidence are removed (1.0 removes all)
+    :param stutter_confidence: Stutter fragments below this confidence are removed
+    :param max_stutter_len: Longest fragment (in characters) treated as a stutter
+    :param max_repeat_gap: Repeats separated by a longer pause (seconds) are kept
+    :param repeat_confidence: Emphatic repeats below this confidence are removed
+    :return: (kept word dicts, dict with the number of removed words per kind)
+    """
+    if not words:
+        return [], {"duplicates": 0, "fillers": 0, "stutters": 0}
+
+    tokens = np.array([word['word'].lower() for word in words])
+    confidence = np.array([word.get('confidence', 1.0) for word in words], dtype=np.float64)
+
+    starts = np.array([word.get('start', 0.0) for word in words], dtype=np.float64)
+    ends = np.array([word.get('end', 0.0) for word in words], dtype=np.float64)
+
+    duplicates = np.zeros(len(tokens), dtype=bool)
+    duplicates[1:] = (
+        (tokens[1:] == tokens[:-1])
+        & (starts[1:] - ends[:-1] <= max_repeat_gap)
+        & (~np.isin(tokens[1:], EMPHATIC_WORDS)
+           | (np.minimum(confidence[1:], confidence[:-1]) < repeat_confidence))
+    )
+
+    fillers = np.isin(tokens, FILLER_WORDS) & (confidence < filler_confidence)
+
+    stutters = np.zeros(len(tokens), dtype=bool)
+    lengths = np.char.str_len(tokens)
+    stutters[:-1] = (
+        np.char.startswith(tokens[1:], tokens[:-1])
+        & (lengths[:-1] < lengths[1:])
+        & (lengths[:-1] <= max_stutter_len)
+        & (confidence[:-1] < stutter_confidence)
+    )
+
+    removed = duplicates | fillers | stutters
+    kept = [dict(words[i]) for i in np.flatnonzero(~removed)]
+
+    # A dropped repetition may carry the punctuation ending a clause ("the the,"),
+    # move it to the kept occurrence so the sentence structure survives
+    kept_index = np.cumsum(~removed) - 1
+    for i in np.flatnonzero(duplicates & ~fillers):
+        if kept_index[i] < 0:
+            continue
+        punctuation = _TRAILING_PUNCTUATION.search(words[i].get('punctuated_word', ''))
+        target = kept[kept_index[i]]
+        if punctuation and 'punctuated_word' in target and not _TRAILING_PUNCTUATION.search(target['punctuated_word']):
+            target['punctuated_word'] += punctuation.group()
+
+    return kept, {
+        "duplicates": int(duplicates.sum()),
+        "fillers": int((fillers & ~duplicates).sum()),
+        "stutters": int((stutters & ~duplicates & ~fillers).sum()),
+    }
+
+
+def clean_transcript(data, **clean_kwargs):
+    """
+    Build a disfluency-free transcript from a Deepgram response.
+
+    Falls back to the raw transcript when the `words` array does not cover it
+    (e.g. hand-written responses with only a few timed words).
+
+    :param data: Deepgram-shaped response dict
+    :param clean_kwargs: Keyword arguments for clean_words
+    :return: (cleaned transcript text, report dict with removed words and token counts)
+    """
+    alternative = data['results']['channels'][0]['alternatives'][0]
+    transcript = alternative['transcript']
+    words = alternative.get('words', [])
+
+    if len(words) < 0.9 * len(transcript.split()):
+        cleaned, removed = transcript, {"duplicates": 0, "fillers": 0, "stutters": 0}
+    else:
+        kept, removed = clean_words(words, **clean_kwargs)
+        cleaned = " ".join(word.get('punctuated_word', word['word']) for word in kept)
+
+    original_tokens = estimate_tokens(transcript)
+    cleaned_tokens = estimate_tokens(cleaned)
+    report = dict(removed,
+                  original_tokens=original_tokens,
+                  cleaned_tokens=cleaned_tokens,
+                  saved_tokens=original_tokens - cleaned_tokens)
+    return cleaned, report
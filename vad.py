@@ -0,0 +1,198 @@
+import json
+import wave
+import numpy as np
+
+
+class TimeOffsetMap:
+    """
+    Map timestamps in silence-trimmed audio back to the original recording.
+
+    The trimmed audio is the concatenation of the kept intervals of the original,
+    so a trimmed timestamp falls in exactly one kept interval and maps to the same
+    offset inside that interval of the original.
+    """
+
+    def __init__(self, kept_intervals):
+        """
+        :param kept_intervals: List of (start, end) seconds of the original audio that were kept
+        """
+        intervals = np.asarray(kept_intervals, dtype=np.float64).reshape(-1, 2)
+        self.original_starts = intervals[:, 0]
+        self.original_ends = intervals[:, 1]
+        durations = self.original_ends - self.original_starts
+        self.trimmed_starts = np.concatenate([[0.0], np.cumsum(durations)[:-1]])
+        self.trimmed_duration = float(durations.sum())
+
+    def to_original(self, timestamps, end=False):
+        """
+        Map trimmed-audio timestamps to original-audio timestamps.
+
+        :param timestamps: Scalar or array of seconds in the trimmed audio
+        :param end: The timestamps end a span; a time exactly on the boundary of two kept
+            intervals then maps to the end of the earlier interval, not the start of the next
+        :return: Scalar or array of seconds in the original audio
+        """
+        t = np.asarray(timestamps, dtype=np.float64)
+        if len(self.trimmed_starts) == 0:
+            return t
+        side = 'left' if end else 'right'
+        idx = np.clip(np.searchsorted(self.trimmed_starts, t, side=side) - 1, 0, None)
+        original = np.minimum(self.original_starts[idx] + (t - self.trimmed_starts[idx]),
+                              self.original_ends[idx])
+        return original if t.ndim else float(original)
+
+    def removed_seconds(self, original_duration):
+        """
+        :param original_duration: Duration of the original audio in seconds
+        :return: Seconds of audio removed by trimming
+        """
+        return original_duration - self.trimmed_duration
+
+    def to_dict(self):
+        return {"kept_intervals": np.stack([self.original_starts, self.original_ends], axis=1).tolist()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["kept_intervals"])
+
+    def save(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.to_dict(), file)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as file:
+            return cls.from_dict(json.load(file))
+
+
+def _true_runs(mask):
+    """
+    :param mask: Boolean array
+    :return: (starts, ends) index arrays of the runs of True values, ends exclusive
+    """
+    padded = np.concatenate([[False], mask, [False]]).astype(np.int8)
+    edges = np.diff(padded)
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def detect_speech_intervals(samples, sample_rate, frame_ms=30, threshold_db=-35.0,
+                            min_silence=0.6, padding=0.15):
+    """
+    Find the intervals of speech in a PCM signal with a frame energy detector.
+
+    :param samples: PCM samples, shape (n,) or (n, channels)
+    :param sample_rate: Sample rate in Hz
+    :param frame_ms: Analysis frame length in milliseconds
+    :param threshold_db: Frames quieter than this, relative to the loudest frame, are silence
+    :param min_silence: Only silences at least this long (seconds) are removed
+    :param padding: Seconds of audio kept around each speech interval
+    :return: List of (start, end) seconds to keep
+    """
+    samples = np.asarray(samples, dtype=np.float32)
+    if samples.ndim == 2:
+        samples = samples.mean(axis=1)
+    duration = len(samples) / sample_rate
+
+    frame_len = max(1, int(sample_rate * frame_ms / 1000))
+    n_frames = len(samples) // frame_len
+    if n_frames == 0:
+        return [(0.0, duration)]
+
+    frames = samples[:n_frames * frame_len].reshape(n_frames, frame_len)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    peak = rms.max()
+    if peak == 0:
+        return []
+    level_db = 20 * np.log10(np.maximum(rms, 1e-12) / peak)
+    starts, ends = _true_runs(level_db > threshold_db)
+    if len(starts) == 0:
+        return []
+
+    frame_seconds = frame_len / sample_rate
+    pad_frames = int(round(padding / frame_seconds))
+    # Close gaps too short to be removed (or that padding would overlap anyway)
+    min_gap = max(int(round(min_silence / frame_seconds)), 2 * pad_frames + 1)
+    breaks = np.flatnonzero(starts[1:] - ends[:-1] >= min_gap)
+    merged_starts = np.concatenate([starts[:1], starts[1:][breaks]])
+    merged_ends = np.concatenate([ends[:-1][breaks], ends[-1:]])
+
+    kept_starts = np.clip((merged_starts - pad_frames) * frame_seconds, 0.0, duration)
+    kept_ends = np.clip((merged_ends + pad_frames) * frame_seconds, 0.0, duration)
+    # The last partial frame belongs to the final interval if speech reaches it
+    if merged_ends[-1] == n_frames:
+        kept_ends[-1] = duration
+    return list(zip(kept_starts.tolist(), kept_ends.tolist()))
+
+
+def read_wav(path):
+    """
+    :param path: Path to a 16-bit PCM WAV file
+    :return: (samples int16 array of shape (n, channels), sample_rate)
+    """
+    with wave.open(path, 'rb') as wav:
+        if wav.getsampwidth() != 2:
+            raise ValueError(f"Only 16-bit PCM WAV is supported, got {8 * wav.getsampwidth()}-bit")
+        channels = wav.getnchannels()
+        sample_rate = wav.getframerate()
+        data = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+    return data.reshape(-1, channels), sample_rate
+
+
+def write_wav(path, samples, sample_rate):
+    """
+    :param path: Output path
+    :param samples: int16 array of shape (n, channels)
+    :param sample_rate: Sample rate in Hz
+    """
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(samples.shape[1])
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(np.ascontiguousarray(samples).tobytes())
+
+
+def trim_silence(audio_path, trimmed_path, **vad_kwargs):
+    """
+    Write a copy of a WAV file with long silences removed.
+
+    :param audio_path: Path to the original 16-bit PCM WAV
+    :param trimmed_path: Path of the trimmed WAV to write
+    :param vad_kwargs: Keyword arguments for detect_speech_intervals
+    :return: TimeOffsetMap from trimmed to original timestamps
+    """
+    samples, sample_rate = read_wav(audio_path)
+    intervals = detect_speech_intervals(samples, sample_rate, **vad_kwargs)
+    if not intervals:
+        intervals = [(0.0, len(samples) / sample_rate)]
+
+    # Index ranges of the kept samples, gathered in a single copy
+    bounds = (np.asarray(intervals) * sample_rate).round().astype(np.int64)
+    index = np.concatenate([np.arange(start, end) for start, end in bounds])
+    write_wav(trimmed_path, samples[index], sample_rate)
+
+    offset_map = TimeOffsetMap(bounds / sample_rate)
+    removed = offset_map.removed_seconds(len(samples) / sample_rate)
+    print(f"VAD removed {removed:.2f}s of silence ({len(intervals)} speech intervals kept)")
+    return offset_map
+
+
+def remap_transcript_timestamps(transcript, offset_map):
+    """
+    Map the word timestamps of a Deepgram-shaped response from the trimmed audio
+    back to the original video, in place.
+
+    :param transcript: Deepgram-shaped response dict
+    :param offset_map: TimeOffsetMap returned by trim_silence
+    :return: The same transcript dict
+    """
+    for channel in transcript['results']['channels']:
+        for alternative in channel['alternatives']:
+            words = alternative.get('words', [])
+            if not words:
+                continue
+            starts = offset_map.to_original([word['start'] for word in words])
+            ends = offset_map.to_original([word['end'] for word in words], end=True)
+            for word, start, end in zip(words, starts.tolist(), ends.tolist()):
+                word['start'] = start
+                word['end'] = end
+    return transcript